@@ -2,30 +2,131 @@
 from __future__ import annotations
 
 import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Self
 
+import attrs
 from path import Path
 
+_DIR_OPEN_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | getattr(os, "O_CLOEXEC", 0)
 
-def clean_preserving_cache(roots: list[Path], cache_file: str) -> None:
+
+@attrs.define
+class PruneStats:
+    nfiles: int = 0
+    ndirs: int = 0
+    nbytes: int = 0
+    nkept: int = 0
+
+    def __iadd__(self, other: PruneStats) -> Self:
+        self.nfiles += other.nfiles
+        self.ndirs += other.ndirs
+        self.nbytes += other.nbytes
+        self.nkept += other.nkept
+        return self
+
+
+def prune_dir_fd(dir_fd: int, cache_file: str, dry_run: bool, stats: PruneStats) -> bool:
+    """Bottom-up prune of the directory open as dir_fd. Returns True if anything was kept."""
+    kept = False
+    with os.scandir(dir_fd) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if prune_subdir(dir_fd, entry.name, cache_file, dry_run, stats):
+                kept = True
+            continue
+        if entry.name == cache_file:
+            stats.nkept += 1
+            kept = True
+            continue
+        stats.nfiles += 1
+        if dry_run:
+            stats.nbytes += entry.stat(follow_symlinks=False).st_size
+        else:
+            os.unlink(entry.name, dir_fd=dir_fd)
+    return kept
+
+
+def prune_subdir(
+    parent_fd: int, name: str, cache_file: str, dry_run: bool, stats: PruneStats
+) -> bool:
+    sub_fd = os.open(name, _DIR_OPEN_FLAGS, dir_fd=parent_fd)
+    try:
+        kept = prune_dir_fd(sub_fd, cache_file, dry_run, stats)
+    finally:
+        os.close(sub_fd)
+    if not kept:
+        stats.ndirs += 1
+        if not dry_run:
+            os.rmdir(name, dir_fd=parent_fd)
+    return kept
+
+
+def _prune_subtree_task(parent_fd: int, name: str, cache_file: str, dry_run: bool) -> PruneStats:
+    stats = PruneStats()
+    prune_subdir(parent_fd, name, cache_file, dry_run, stats)
+    return stats
+
+
+def clean_preserving_cache(
+    roots: list[Path], cache_file: str, dry_run: bool = False, jobs: int | None = None
+) -> PruneStats:
+    """Remove everything under roots except cache_file files and the directories holding them.
+
+    Each root gets a single bottom-up os.scandir pass with unlinks/rmdirs relative to directory
+    fds. The subtrees directly below the roots are spread across a thread pool.
+    """
     for root in roots:
         if not isinstance(root, Path) or not root.is_dir():
             raise TypeError(f"Root path '{root}' is not a directory")
-        if not isinstance(cache_file, str):
-            raise TypeError(f"cache_file is not str it is {type(cache_file)}")
-        for f in root.walk():
-            if f.is_dir():
-                continue
-            if f.name != cache_file:
-                f.remove()
-        for d in root.walkdirs():
-            pcf = d / cache_file
-            if not pcf.exists():
-                d.rmtree()
+    if not isinstance(cache_file, str):
+        raise TypeError(f"cache_file is not str it is {type(cache_file)}")
+    total = PruneStats()
+    root_fds = [os.open(root, _DIR_OPEN_FLAGS & ~os.O_NOFOLLOW) for root in roots]
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futs = []
+            for root_fd in root_fds:
+                with os.scandir(root_fd) as it:
+                    entries = list(it)
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        futs.append(
+                            pool.submit(
+                                _prune_subtree_task, root_fd, entry.name, cache_file, dry_run
+                            )
+                        )
+                    elif entry.name == cache_file:
+                        total.nkept += 1
+                    else:
+                        total.nfiles += 1
+                        if dry_run:
+                            total.nbytes += entry.stat(follow_symlinks=False).st_size
+                        else:
+                            os.unlink(entry.name, dir_fd=root_fd)
+            for fut in futs:
+                total += fut.result()
+    finally:
+        for root_fd in root_fds:
+            os.close(root_fd)
+    return total
 
 
 def real_main(args: argparse.Namespace) -> None:
     dir_paths: list[Path] = args.directory
-    clean_preserving_cache(dir_paths, args.cache_file)
+    stats = clean_preserving_cache(dir_paths, args.cache_file, dry_run=args.dry_run, jobs=args.jobs)
+    if args.dry_run:
+        print(
+            f"would remove {stats.nfiles} files ({stats.nbytes} bytes) and {stats.ndirs} "
+            f"directories, keeping {stats.nkept} '{args.cache_file}' files"
+        )
+    else:
+        print(
+            f"removed {stats.nfiles} files and {stats.ndirs} directories, "
+            f"kept {stats.nkept} '{args.cache_file}' files"
+        )
 
 
 def get_arg_parser() -> argparse.ArgumentParser:
@@ -39,6 +140,13 @@ def get_arg_parser() -> argparse.ArgumentParser:
         help="Directory(ies) to [[WARNING]] RECURSIVELY DELETE [[[WARNING]]]",
     )
     parser.add_argument("-C", "--cache-file", default="config.cache", help="config cache name")
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Only report what would be removed, with byte and entry counts",
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="Number of subtree worker threads")
     return parser
 
 
@@ -1,33 +1,301 @@
 #!/usr/bin/env python3
 
 import argparse
+import io
+import mmap
+import os
+import random
+import stat
 import sys
+from array import array
+from collections.abc import Callable, Iterator
+from contextlib import ExitStack
+from typing import BinaryIO
 
+import attrs
 from path import Path
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CHUNK_SIZE = 1024 * 1024
+
+# EXPLODE_LUTS[msb_first][b] is the 8 0/1 bytes of b in that bit order
+EXPLODE_LUTS: dict[bool, list[bytes]] = {
+    False: [bytes((b >> j) & 1 for j in range(8)) for b in range(256)],
+    True: [bytes((b >> (7 - j)) & 1 for j in range(8)) for b in range(256)],
+}
+# keyed by the 8 exploded bytes read as one native endian uint64
+IMPLODE_LUTS: dict[bool, dict[int, int]] = {
+    msb_first: {int.from_bytes(exploded, sys.byteorder): b for b, exploded in enumerate(lut)}
+    for msb_first, lut in EXPLODE_LUTS.items()
+}
+WORD_TYPECODES = {2: "H", 4: "I", 8: "Q"}
+TO_ASCII = bytes.maketrans(b"\x00\x01", b"01")
+FROM_ASCII = bytes.maketrans(b"01", b"\x00\x01")
+
+
+@attrs.define(frozen=True)
+class BitLayout:
+    msb_first: bool = False
+    word_bits: int = 8
+    big_endian: bool = False
+
+    @property
+    def word_bytes(self) -> int:
+        return self.word_bits // 8
+
+    @property
+    def swap_words(self) -> bool:
+        # LSB first output starts with the least significant byte of each word, MSB first with
+        # the most significant one, byte swap words whose storage order is the other way around
+        return self.word_bits > 8 and self.big_endian != self.msb_first
+
+    @property
+    def bitorder(self) -> str:
+        return "big" if self.msb_first else "little"
+
+
+def _swap_words(buf: bytes, word_bytes: int) -> bytes:
+    words = array(WORD_TYPECODES[word_bytes], buf)
+    words.byteswap()
+    return words.tobytes()
+
+
+def explode_lut(buf: bytes, layout: BitLayout) -> bytes:
+    if layout.swap_words:
+        buf = _swap_words(buf, layout.word_bytes)
+    return b"".join(map(EXPLODE_LUTS[layout.msb_first].__getitem__, buf))
+
+
+def implode_lut(buf: bytes, layout: BitLayout) -> bytes:
+    try:
+        packed = bytes(map(IMPLODE_LUTS[layout.msb_first].__getitem__, array("Q", buf)))
+    except KeyError:
+        raise ValueError("input contains bytes other than 0 and 1") from None
+    if layout.swap_words:
+        packed = _swap_words(packed, layout.word_bytes)
+    return packed
+
+
+def explode_numpy(buf: bytes, layout: BitLayout) -> bytes:
+    octets = np.frombuffer(buf, np.uint8)
+    if layout.swap_words:
+        octets = octets.reshape(-1, layout.word_bytes)[:, ::-1]
+    return np.unpackbits(octets, bitorder=layout.bitorder).tobytes()
+
+
+def implode_numpy(buf: bytes, layout: BitLayout) -> bytes:
+    bits = np.frombuffer(buf, np.uint8)
+    if (bits > 1).any():
+        raise ValueError("input contains bytes other than 0 and 1")
+    packed = np.packbits(bits, bitorder=layout.bitorder)
+    if layout.swap_words:
+        packed = packed.reshape(-1, layout.word_bytes)[:, ::-1]
+    return packed.tobytes()
+
+
+def bit_planes_numpy(buf: bytes, layout: BitLayout) -> list[bytes]:
+    """Packed plane of every word's bit k for k in [0, word_bits), LSB is bit 0."""
+    octets = np.frombuffer(buf, np.uint8).reshape(-1, layout.word_bytes)
+    if not layout.big_endian:
+        octets = octets[:, ::-1]
+    # column c holds bit word_bits - 1 - c of each word
+    bits = np.unpackbits(octets, axis=1, bitorder="big")
+    return [
+        np.packbits(bits[:, layout.word_bits - 1 - k], bitorder=layout.bitorder).tobytes()
+        for k in range(layout.word_bits)
+    ]
+
+
+ENGINES: dict[
+    str, tuple[Callable[[bytes, BitLayout], bytes], Callable[[bytes, BitLayout], bytes]]
+] = {
+    "lut": (explode_lut, implode_lut),
+    "numpy": (explode_numpy, implode_numpy),
+}
+
+
+def iter_chunks(fh: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    try:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # pipes, ttys and empty files can't be mapped
+        while chunk := fh.read(chunk_size):
+            yield chunk
+        return
+    with mm:
+        for off in range(0, len(mm), chunk_size):
+            yield mm[off : off + chunk_size]
+
+
+def check_input_size(fh: BinaryIO, align: int) -> None:
+    # catch a bad length before any output is written, only knowable up front for regular files
+    st = os.fstat(fh.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size % align:
+        raise ValueError(f"input length {st.st_size} is not a multiple of {align} bytes")
+
+
+def iter_aligned_chunks(
+    fh: BinaryIO, chunk_size: int, align: int, pad_to: int | None = None
+) -> Iterator[bytes]:
+    """Chunks that are multiples of align bytes. With pad_to, a final partial chunk that is a
+    multiple of pad_to bytes is zero padded to align instead of being an error."""
+    carry = b""
+    for chunk in iter_chunks(fh, chunk_size):
+        buf = carry + chunk
+        aligned_len = len(buf) - len(buf) % align
+        if aligned_len:
+            yield buf[:aligned_len]
+        carry = buf[aligned_len:]
+    if carry:
+        if pad_to is None or len(carry) % pad_to:
+            raise ValueError(f"input length is not a multiple of {pad_to or align} bytes")
+        yield carry + bytes(align - len(carry))
+
+
+def write_planes(inf: BinaryIO, plane_files: list[BinaryIO], layout: BitLayout) -> None:
+    # whole bytes of every plane per chunk, 8 words a piece, the last plane byte is zero padded
+    chunks = iter_aligned_chunks(inf, CHUNK_SIZE, layout.word_bytes * 8, pad_to=layout.word_bytes)
+    for chunk in chunks:
+        for plane_file, plane in zip(plane_files, bit_planes_numpy(chunk, layout), strict=True):
+            plane_file.write(plane)
+
+
+def self_test() -> int:
+    """Check every engine and layout on random inputs of awkward lengths."""
+    rng = random.Random(0)
+    nfail = 0
+    for word_bits in (8, 16, 32, 64):
+        word_bytes = word_bits // 8
+        for nwords in (0, 1, 3, 7, 8, 9, 13, 100):
+            buf = rng.randbytes(nwords * word_bytes)
+            for msb_first, big_endian in ((False, False), (True, False), (False, True)):
+                layout = BitLayout(msb_first=msb_first, word_bits=word_bits, big_endian=big_endian)
+                words = [
+                    int.from_bytes(buf[i : i + word_bytes], "big" if big_endian else "little")
+                    for i in range(0, len(buf), word_bytes)
+                ]
+                order = range(word_bits - 1, -1, -1) if msb_first else range(word_bits)
+                expected = bytes((w >> k) & 1 for w in words for k in order)
+                for name, (explode, implode) in ENGINES.items():
+                    if name == "numpy" and np is None:
+                        continue
+                    if explode(buf, layout) != expected or implode(expected, layout) != buf:
+                        print(f"FAIL {name} {layout} nwords={nwords}", file=sys.stderr)
+                        nfail += 1
+                if np is None:
+                    continue
+                planes = [io.BytesIO() for _ in range(word_bits)]
+                write_planes(io.BytesIO(buf), planes, layout)
+                npad = -nwords % 8
+                for k, plane in enumerate(planes):
+                    bits = [(w >> k) & 1 for w in words] + [0] * npad
+                    want = np.packbits(np.array(bits, np.uint8), bitorder=layout.bitorder)
+                    if plane.getvalue() != want.tobytes():
+                        print(f"FAIL planes bit {k} {layout} nwords={nwords}", file=sys.stderr)
+                        nfail += 1
+    print(f"self test: {nfail} failures", file=sys.stderr)
+    return 1 if nfail else 0
+
 
 def real_main(args) -> int:
-    assert args.in_file is not None
-    assert args.out_file is not None
-    in_buf = open(args.in_file, "rb").read()
-    out_buf = bytearray(len(in_buf) * 8)
-    for i, b in enumerate(in_buf):
-        for j in range(8):
-            out_buf[i * 8 + j] = b & 1
-            b >>= 1
-    open(args.out_file, "wb").write(out_buf)
+    if args.self_test:
+        return self_test()
+    if args.in_file is None or args.out_file is None:
+        raise ValueError("-i/--in-file and -o/--out-file are required")
+    engine = args.engine
+    if engine == "auto":
+        engine = "numpy" if np is not None else "lut"
+    elif engine == "numpy" and np is None:
+        raise ValueError("numpy engine requested but numpy isn't installed")
+    if args.format == "planes" and (engine != "numpy" or args.implode):
+        raise ValueError("bit plane output needs the numpy engine and can't be imploded")
+    explode, implode = ENGINES[engine]
+    layout = BitLayout(
+        msb_first=args.bit_order == "msb",
+        word_bits=args.word_bits,
+        big_endian=args.endian == "big",
+    )
+    with ExitStack() as stack:
+        inf = stack.enter_context(open(args.in_file, "rb"))
+        check_input_size(inf, layout.word_bits if args.implode else layout.word_bytes)
+        if args.format == "planes":
+            plane_files = [
+                stack.enter_context(open(f"{args.out_file}.bit{k:02d}", "wb"))
+                for k in range(layout.word_bits)
+            ]
+            write_planes(inf, plane_files, layout)
+            return 0
+        outf = stack.enter_context(open(args.out_file, "wb"))
+        if args.implode:
+            # implode consumes 8 input bytes per output byte, size chunks to match output size
+            for chunk in iter_aligned_chunks(inf, CHUNK_SIZE * 8, layout.word_bits):
+                if args.format == "ascii":
+                    chunk = chunk.translate(FROM_ASCII)
+                outf.write(implode(chunk, layout))
+        else:
+            for chunk in iter_aligned_chunks(inf, CHUNK_SIZE, layout.word_bytes):
+                bits = explode(chunk, layout)
+                outf.write(bits.translate(TO_ASCII) if args.format == "ascii" else bits)
     return 0
 
 
 def get_arg_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(description="1 byte => 8 0/1 bytes")
-    parser.add_argument("-i", "--in-file", required=True, type=Path, help="Input path")
-    parser.add_argument("-o", "--out-file", required=True, type=Path, help="Output path")
+    parser = argparse.ArgumentParser(description="1 byte => 8 0/1 bytes (or back with --implode)")
+    parser.add_argument("-i", "--in-file", type=Path, help="Input path")
+    parser.add_argument(
+        "-o",
+        "--out-file",
+        type=Path,
+        help="Output path (prefix of the <out>.bitNN files for planes)",
+    )
+    parser.add_argument(
+        "-I", "--implode", action="store_true", help="Pack 8 0/1 bytes back into 1 byte"
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=("auto", "lut", "numpy"),
+        default="auto",
+        help="Bit (un)packing engine, auto uses numpy if it is installed",
+    )
+    parser.add_argument(
+        "-b", "--bit-order", choices=("lsb", "msb"), default="lsb", help="Bit output order"
+    )
+    parser.add_argument(
+        "-w",
+        "--word-bits",
+        type=int,
+        choices=(8, 16, 32, 64),
+        default=8,
+        help="Explode input as words of this many bits",
+    )
+    parser.add_argument(
+        "-E", "--endian", choices=("little", "big"), default="little", help="Word endianness"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=("bytes", "ascii", "planes"),
+        default="bytes",
+        help="0/1 bytes, '0'/'1' characters or one packed file per word bit position",
+    )
+    parser.add_argument(
+        "--self-test", action="store_true", help="Check all engines and layouts, then exit"
+    )
     return parser
 
 
 def main() -> int:
-    return real_main(get_arg_parser().parse_args())
+    parser = get_arg_parser()
+    args = parser.parse_args()
+    try:
+        return real_main(args)
+    except ValueError as e:
+        parser.error(str(e))
 
 
 if __name__ == "__main__":
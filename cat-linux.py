@@ -1,19 +1,149 @@
 #!/usr/bin/env python3
 
+import argparse
+import errno
+import os
+import sys
+
+import attrs
 from path import Path
 
+DEFAULT_SUFFIXES = [".c", ".h"]
+COPY_CHUNK_SIZE = 1 << 30
+READ_CHUNK_SIZE = 1 << 20
+# errnos meaning "this copy method can't handle these fds", not a real I/O error
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.EBADF,
+    errno.ENOTSOCK,
+}
+
+
+def get_files(root: Path, suffixes: list[str], skip: Path | None = None) -> list[Path]:
+    # sorted on the relative path so the output is identical regardless of readdir order
+    skip = skip.absolute() if skip is not None else None
+    return sorted(
+        f for f in root.walkfiles() if f.suffix in suffixes and f.is_file() and f.absolute() != skip
+    )
+
+
+@attrs.define
+class ConcatWriter:
+    """Appends whole files to out_fd, preferring in-kernel copies over read/write."""
+
+    out_fd: int
+    offset: int = 0
+    use_copy_file_range: bool = hasattr(os, "copy_file_range")
+    # only Linux sendfile() writes to regular files, macOS/BSD want a socket and an int offset
+    use_sendfile: bool = sys.platform == "linux" and hasattr(os, "sendfile")
+
+    def _copy_fd(self, in_fd: int) -> int:
+        total = 0
+        while self.use_copy_file_range:
+            try:
+                n = os.copy_file_range(in_fd, self.out_fd, COPY_CHUNK_SIZE)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                self.use_copy_file_range = False
+                break
+            if not n:
+                return total
+            total += n
+        while self.use_sendfile:
+            try:
+                n = os.sendfile(self.out_fd, in_fd, None, COPY_CHUNK_SIZE)
+            except TypeError:
+                self.use_sendfile = False
+                break
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                self.use_sendfile = False
+                break
+            if not n:
+                return total
+            total += n
+        while buf := os.read(in_fd, READ_CHUNK_SIZE):
+            view = memoryview(buf)
+            while view:
+                view = view[os.write(self.out_fd, view) :]
+            total += len(buf)
+        return total
+
+    def append(self, pth: Path) -> tuple[int, int]:
+        """Copy pth to the output, returns its (offset, length) in the output."""
+        in_fd = os.open(pth, os.O_RDONLY)
+        try:
+            n = self._copy_fd(in_fd)
+        finally:
+            os.close(in_fd)
+        start = self.offset
+        self.offset += n
+        return start, n
+
+
+def concat_files(files: list[Path], out_fd: int, index_file: Path | None = None) -> int:
+    writer = ConcatWriter(out_fd)
+    index_lines = []
+    for f in files:
+        start, n = writer.append(f)
+        index_lines.append(f"{start}\t{n}\t{f}\n")
+    if index_file is not None:
+        with open(index_file, "w") as idxf:
+            idxf.writelines(index_lines)
+    return writer.offset
+
+
+def real_main(args: argparse.Namespace) -> int:
+    suffixes = args.suffix or DEFAULT_SUFFIXES
+    if args.output == "-":
+        out_fd = sys.stdout.fileno()
+        files = get_files(args.root, suffixes)
+        concat_files(files, out_fd, args.index)
+        return 0
+    out_path = Path(args.output)
+    out_fd = os.open(out_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        files = get_files(args.root, suffixes, skip=out_path)
+        nbytes = concat_files(files, out_fd, args.index)
+    finally:
+        os.close(out_fd)
+    print(f"wrote {nbytes} bytes from {len(files)} files to {out_path}", file=sys.stderr)
+    return 0
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Concatenate all C sources of a tree (e.g. Linux) into a single file"
+    )
+    parser.add_argument(
+        "root", nargs="?", type=Path, default=Path(), help="Source tree root (default: .)"
+    )
+    parser.add_argument(
+        "-o", "--output", default="../cat-linux.c", help="Output file, '-' for stdout"
+    )
+    parser.add_argument(
+        "-s",
+        "--suffix",
+        action="append",
+        help=f"File suffix to include, repeatable (default: {' '.join(DEFAULT_SUFFIXES)})",
+    )
+    parser.add_argument(
+        "-i",
+        "--index",
+        type=Path,
+        help="Write a sidecar index of 'offset<TAB>length<TAB>path' lines for the output",
+    )
+    return parser
 
-def do_want(p: Path) -> bool:
-    # print(f"p: {p} suffix: {p.suffix}")
-    if not p.is_file():
-        return False
-    if p.suffix != ".c" and p.suffix != ".h":
-        return False
-    return True
 
+def main() -> int:
+    return real_main(get_arg_parser().parse_args())
 
-clf = open("../cat-linux.c", "wb")
 
-for f in Path().walkfiles(do_want):
-    with open(f, "rb") as inf:
-        clf.write(inf.read())
+if __name__ == "__main__":
+    sys.exit(main())
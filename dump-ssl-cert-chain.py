@@ -1,107 +1,436 @@
 #!/usr/bin/env python3
 
+import argparse
+import datetime
+import functools
+import hashlib
+import ipaddress
+import itertools
+import json
+import os
 import socket
-import ssl
+import struct
 import sys
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import attrs
 import certifi
 import OpenSSL
 import requests
-from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.x509 import (
+    BasicConstraints,
+    Certificate,
+    CertificateRevocationList,
     DNSName,
+    ExtensionNotFound,
+    IPAddress,
+    UniformResourceIdentifier,
     load_der_x509_certificate,
     load_der_x509_crl,
-    load_pem_x509_certificate,
     load_pem_x509_certificates,
     load_pem_x509_crl,
 )
 from cryptography.x509.extensions import CRLDistributionPoints
-from cryptography.x509.verification import PolicyBuilder, Store
+from cryptography.x509.verification import PolicyBuilder, Store, VerificationError
+from path import Path
 from rich import print
+from rich.console import Console
+from rich.table import Table
 
-session = requests.Session()
+_tls = threading.local()
 
 
-def get_certificate_chain(host, port: int = 443):
-    # Create a socket and wrap it in an SSL context
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def get_session() -> requests.Session:
+    # requests.Session isn't documented as thread safe, keep one per worker thread
+    if not hasattr(_tls, "session"):
+        _tls.session = requests.Session()
+    return _tls.session
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path("~/.cache").expanduser()
+    return Path(cache_home) / "dump-ssl-cert-chain"
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.UTC)
+
+
+def _is_ca(cert: Certificate) -> bool:
+    try:
+        return cert.extensions.get_extension_for_class(BasicConstraints).value.ca
+    except ExtensionNotFound:
+        return False
+
+
+class PkiCache:
+    """Content-addressed on-disk store of CRLs and intermediate CA certificates.
+
+    DER blobs live in blobs/<sha256>, CRL URLs map to blobs through small crls/<sha256(url)>.json
+    index entries that also keep the HTTP validators of the last fetch. A cached CRL is used
+    without touching the network until its own nextUpdate has passed.
+    Intermediates are kept in intermediates/<sha256> and indexed by subject in memory.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.blob_dir = root / "blobs"
+        self.crl_dir = root / "crls"
+        self.intermediate_dir = root / "intermediates"
+        for d in (self.blob_dir, self.crl_dir, self.intermediate_dir):
+            d.makedirs_p()
+        self._lock = threading.Lock()
+        self._crls: dict[str, CertificateRevocationList] = {}
+        self._intermediates: dict[bytes, dict[str, Certificate]] = {}
+        now = _utcnow()
+        for f in self.intermediate_dir.files():
+            cert = load_der_x509_certificate(f.read_bytes())
+            if cert.not_valid_after_utc > now:
+                self._intermediates.setdefault(cert.subject.public_bytes(), {})[f.name] = cert
+
+    @staticmethod
+    def _atomic_write(pth: Path, data: bytes) -> None:
+        with tempfile.NamedTemporaryFile(dir=pth.parent, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, pth)
+
+    def _crl_index_path(self, url: str) -> Path:
+        return self.crl_dir / (hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def get_crl(self, url: str) -> tuple[CertificateRevocationList | None, dict[str, str]]:
+        """Cached CRL (None if missing) and its index entry for conditional re-fetching."""
+        idx_path = self._crl_index_path(url)
+        if not idx_path.is_file():
+            return None, {}
+        entry = json.loads(idx_path.read_bytes())
+        digest = entry["digest"]
+        with self._lock:
+            crl = self._crls.get(digest)
+        if crl is None:
+            blob_path = self.blob_dir / digest
+            if not blob_path.is_file():
+                return None, {}
+            crl = load_der_x509_crl(blob_path.read_bytes())
+            with self._lock:
+                self._crls[digest] = crl
+        return crl, entry
+
+    def put_crl(
+        self, url: str, crl: CertificateRevocationList, etag: str | None, last_modified: str | None
+    ) -> None:
+        der = crl.public_bytes(serialization.Encoding.DER)
+        digest = hashlib.sha256(der).hexdigest()
+        blob_path = self.blob_dir / digest
+        if not blob_path.is_file():
+            self._atomic_write(blob_path, der)
+        entry = {"url": url, "digest": digest}
+        if etag:
+            entry["etag"] = etag
+        if last_modified:
+            entry["last_modified"] = last_modified
+        self._atomic_write(self._crl_index_path(url), json.dumps(entry).encode())
+        with self._lock:
+            self._crls[digest] = crl
+
+    def add_intermediates(self, certs: list[Certificate]) -> None:
+        for cert in certs:
+            if not _is_ca(cert) or cert.subject == cert.issuer:
+                continue
+            der = cert.public_bytes(serialization.Encoding.DER)
+            digest = hashlib.sha256(der).hexdigest()
+            with self._lock:
+                by_digest = self._intermediates.setdefault(cert.subject.public_bytes(), {})
+                if digest in by_digest:
+                    continue
+                by_digest[digest] = cert
+            self._atomic_write(self.intermediate_dir / digest, der)
+
+    def issuer_candidates(self, chain: list[Certificate], max_depth: int = 8) -> list[Certificate]:
+        """Cached intermediates that could complete chain, following issuers up to max_depth."""
+        seen = {c.fingerprint(hashes.SHA256()) for c in chain}
+        found: list[Certificate] = []
+        wanted = {c.issuer.public_bytes() for c in chain}
+        for _ in range(max_depth):
+            with self._lock:
+                new = [
+                    c
+                    for name in wanted
+                    for c in self._intermediates.get(name, {}).values()
+                    if c.fingerprint(hashes.SHA256()) not in seen
+                ]
+            if not new:
+                break
+            seen.update(c.fingerprint(hashes.SHA256()) for c in new)
+            found += new
+            wanted = {c.issuer.public_bytes() for c in new}
+        return found
+
+
+def crl_is_fresh(crl: CertificateRevocationList) -> bool:
+    next_update = crl.next_update_utc
+    return next_update is not None and next_update > _utcnow()
+
+
+@attrs.define
+class HostResult:
+    host: str
+    port: int
+    tls_version: str | None = None
+    chain: list[Certificate] = attrs.Factory(list)
+    verified_chain: list[Certificate] = attrs.Factory(list)
+    revoked: list[Certificate] = attrs.Factory(list)
+    error: str | None = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+def parse_host(spec: str, default_port: int = 443) -> tuple[str, int]:
+    if spec.startswith("["):
+        host, _, port = spec[1:].partition("]:")
+        return host.rstrip("]"), int(port) if port else default_port
+    if spec.count(":") == 1:
+        host, port = spec.split(":")
+        return host, int(port)
+    return spec, default_port
+
+
+@functools.cache
+def load_trust_store(ca_file: str) -> Store:
+    with open(ca_file, "rb") as pems:
+        return Store(load_pem_x509_certificates(pems.read()))
+
+
+def get_certificate_chain(
+    host: str, port: int = 443, timeout: float = 10.0
+) -> tuple[str, list[Certificate]]:
+    sock = socket.create_connection((host, port), timeout=timeout)
+    # pyOpenSSL doesn't cope with python level socket timeouts, use kernel ones instead
+    sock.settimeout(None)
+    tv = struct.pack("ll", int(timeout), int((timeout % 1) * 1_000_000))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, tv)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, tv)
     context = OpenSSL.SSL.Context(OpenSSL.SSL.TLS_METHOD)
     connection = OpenSSL.SSL.Connection(context, sock)
+    try:
+        connection.set_tlsext_host_name(host.encode())
+        connection.set_connect_state()
+        connection.do_handshake()
+        tls_version = connection.get_protocol_version_name()
+        certs = [cert.to_cryptography() for cert in connection.get_peer_cert_chain() or []]
+        connection.shutdown()
+    finally:
+        connection.close()
+        sock.close()
+    return tls_version, certs
+
+
+def verify_chain(
+    host: str, store: Store, chain: list[Certificate], extra_intermediates: list[Certificate]
+) -> list[Certificate]:
+    try:
+        subject = IPAddress(ipaddress.ip_address(host))
+    except ValueError:
+        subject = DNSName(host)
+    verifier = PolicyBuilder().store(store).build_server_verifier(subject)
+    return verifier.verify(chain[0], chain[1:] + extra_intermediates)
+
+
+def fetch_host(
+    host: str, port: int, store: Store, timeout: float, cache: PkiCache | None
+) -> HostResult:
+    res = HostResult(host, port)
+    try:
+        res.tls_version, res.chain = get_certificate_chain(host, port, timeout)
+        if not res.chain:
+            raise ValueError("peer sent no certificates")
+        extra_intermediates = []
+        if cache is not None:
+            # lets servers that send incomplete chains verify against previously seen CAs
+            cache.add_intermediates(res.chain[1:])
+            extra_intermediates = cache.issuer_candidates(res.chain)
+        res.verified_chain = verify_chain(host, store, res.chain, extra_intermediates)
+    except (OSError, OpenSSL.SSL.Error, ValueError, VerificationError) as e:
+        res.error = f"{type(e).__name__}: {e}"
+    return res
+
+
+def crl_urls(cert: Certificate) -> list[str]:
+    try:
+        dist_points = cert.extensions.get_extension_for_class(CRLDistributionPoints).value
+    except ExtensionNotFound:
+        return []
+    return [
+        name.value
+        for dist_point in dist_points
+        for name in dist_point.full_name or []
+        if isinstance(name, UniformResourceIdentifier)
+    ]
+
+
+def fetch_crl(url: str, timeout: float, cache: PkiCache | None) -> CertificateRevocationList | None:
+    cached_crl, entry = cache.get_crl(url) if cache is not None else (None, {})
+    if cached_crl is not None and crl_is_fresh(cached_crl):
+        return cached_crl
+    headers = {}
+    if cached_crl is not None:
+        if "etag" in entry:
+            headers["If-None-Match"] = entry["etag"]
+        if "last_modified" in entry:
+            headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        resp = get_session().get(url, timeout=timeout, headers=headers)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        print(f"[yellow]Warning: fetching CRL {url} failed: {e}[/yellow]", file=sys.stderr)
+        # a stale CRL still beats none at all
+        return cached_crl
+    if resp.status_code == 304 and cached_crl is not None:
+        return cached_crl
+    crl_blob = resp.content
+    try:
+        crl = load_der_x509_crl(crl_blob)
+    except ValueError:
+        try:
+            crl = load_pem_x509_crl(crl_blob)
+        except ValueError:
+            print(f"[yellow]Warning: couldn't parse CRL {url}[/yellow]", file=sys.stderr)
+            return cached_crl
+    if cache is not None:
+        cache.put_crl(url, crl, resp.headers.get("ETag"), resp.headers.get("Last-Modified"))
+    return crl
+
+
+def find_revoked(
+    chain: list[Certificate], crls: dict[str, CertificateRevocationList | None]
+) -> list[Certificate]:
+    revoked = []
+    for cert, issuer in itertools.pairwise(chain):
+        for url in crl_urls(cert):
+            crl = crls.get(url)
+            if crl is None or not crl.is_signature_valid(issuer.public_key()):
+                continue
+            if crl.get_revoked_certificate_by_serial_number(cert.serial_number) is not None:
+                revoked.append(cert)
+                break
+    return revoked
+
+
+def audit_hosts(
+    hosts: list[tuple[str, int]],
+    store: Store,
+    jobs: int,
+    timeout: float,
+    check_crls: bool,
+    cache: PkiCache | None,
+) -> list[HostResult]:
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(lambda hp: fetch_host(*hp, store, timeout, cache), hosts))
+        if not check_crls:
+            return results
+        # dict keeps first seen order and dedupes URLs shared by many chains
+        urls = list(
+            dict.fromkeys(url for res in results for cert in res.chain for url in crl_urls(cert))
+        )
+        crls = dict(zip(urls, pool.map(lambda url: fetch_crl(url, timeout, cache), urls)))
+    for res in results:
+        res.revoked = find_revoked(res.verified_chain or res.chain, crls)
+    return results
+
+
+def print_host_detail(res: HostResult) -> None:
+    if res.error is not None:
+        print(f"[red]{res.name}: {res.error}[/red]")
+    if not res.chain:
+        return
+    print(f"TLS version: {res.tls_version}")
+    print("Certificate:")
+    print(res.chain[0])
+    print(f"subject: {res.chain[0].subject.rfc4514_string()}")
+    print(f"issuer: {res.chain[0].issuer.rfc4514_string()}")
+    for cert in res.revoked:
+        print(f"[red]REVOKED: {cert.subject.rfc4514_string()}[/red]")
+    print(res.verified_chain)
+    for i, cert in enumerate(res.verified_chain):
+        with open(f"ssl-cert-chain-{i}.pem", "w") as f:
+            f.write(cert.public_bytes(serialization.Encoding.PEM).decode())
+
+
+def print_summary(results: list[HostResult]) -> None:
+    table = Table(title="Certificate chain audit")
+    table.add_column("Host", style="cyan", no_wrap=True)
+    table.add_column("TLS")
+    table.add_column("Leaf subject")
+    table.add_column("Not after")
+    table.add_column("Chain")
+    table.add_column("Status")
+    for res in results:
+        leaf = res.chain[0] if res.chain else None
+        if res.error is not None:
+            status = f"[red]{res.error}[/red]"
+        elif res.revoked:
+            status = "[red]REVOKED[/red]"
+        else:
+            status = "[green]ok[/green]"
+        table.add_row(
+            res.name,
+            res.tls_version or "",
+            leaf.subject.rfc4514_string() if leaf else "",
+            leaf.not_valid_after_utc.isoformat() if leaf else "",
+            str(len(res.verified_chain or res.chain)),
+            status,
+        )
+    Console().print(table)
+
+
+def read_hosts_file(path: str) -> list[str]:
+    with sys.stdin if path == "-" else open(path) as f:
+        return [ln for ln in (line.split("#", 1)[0].strip() for line in f) if ln]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Fetch, verify and CRL check TLS certificate chains"
+    )
+    parser.add_argument("hosts", nargs="*", metavar="HOST[:PORT]", help="Hosts to audit")
+    parser.add_argument(
+        "-f", "--hosts-file", help="File with one HOST[:PORT] per line ('-' for stdin)"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=32, help="Number of concurrent connections/fetches"
+    )
+    parser.add_argument("-t", "--timeout", type=float, default=10.0, help="Network timeout")
+    parser.add_argument(
+        "--ca-file", default=certifi.where(), help="Trust anchors PEM bundle (default: certifi)"
+    )
+    parser.add_argument("--no-crl", action="store_true", help="Don't fetch and check CRLs")
+    parser.add_argument(
+        "--cache-dir", type=Path, default=default_cache_dir(), help="CRL and intermediate cache"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Don't use the CRL and intermediate cache"
+    )
+    args = parser.parse_args()
+
+    host_specs = list(args.hosts)
+    if args.hosts_file is not None:
+        host_specs += read_hosts_file(args.hosts_file)
+    if not host_specs:
+        parser.error("no hosts given")
+    hosts = [parse_host(spec) for spec in host_specs]
+
+    store = load_trust_store(args.ca_file)
+    cache = None if args.no_cache else PkiCache(args.cache_dir)
+    results = audit_hosts(hosts, store, args.jobs, args.timeout, not args.no_crl, cache)
+    if len(results) == 1 and args.hosts_file is None:
+        print_host_detail(results[0])
+    else:
+        print_summary(results)
+    return 1 if any(res.error is not None or res.revoked for res in results) else 0
+
 
-    # Connect and perform the handshake to retrieve the certificate chain
-    connection.connect((host, port))
-    connection.do_handshake()
-    chain = connection.get_peer_cert_chain()
-    certs = [cert.to_cryptography() for cert in chain]
-    chain_crls = []
-    for cert in certs:
-        for ext in cert.extensions:
-            if isinstance(ext.value, CRLDistributionPoints):
-                for dist_point in ext.value:
-                    for crl_url in dist_point.full_name:
-                        resp = session.get(crl_url.value)
-                        crl_blob = resp.content
-                        try:
-                            crl = load_der_x509_crl(crl_blob)
-                        except Exception:
-                            try:
-                                crl = load_pem_x509_crl(crl_blob)
-                            except Exception:
-                                continue
-                        pem_crl = crl.public_bytes(encoding=serialization.Encoding.PEM).decode()
-                        chain_crls.append(pem_crl)
-
-    # Convert the chain to PEM format
-    pem_chain = [cert.public_bytes(serialization.Encoding.PEM).decode() for cert in certs]
-
-    # Close the connection
-    connection.shutdown()
-    connection.close()
-
-    return pem_chain, chain_crls
-
-
-hostname = sys.argv[1]
-
-with open(certifi.where(), "rb") as pems:
-    store = Store(load_pem_x509_certificates(pems.read()))
-
-builder = PolicyBuilder().store(store)
-verifier = builder.build_server_verifier(DNSName(hostname))
-
-context = ssl.create_default_context()
-context.load_verify_locations(cafile=certifi.where())
-print(f"context cert store stats: {context.cert_store_stats()}")
-chain_certs, chain_crls = get_certificate_chain(hostname)
-for cert in chain_certs:
-    context.load_verify_locations(cadata=cert)
-for pem_crl in chain_crls:
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".pem") as f:
-        f.write(pem_crl)
-        f.flush()
-        context.load_verify_locations(cafile=f.name)
-print(f"context cert store stats: {context.cert_store_stats()}")
-
-with socket.create_connection((hostname, 443)) as sock:
-    with context.wrap_socket(sock, server_hostname=hostname) as ssock:
-        tls_version = ssock.version()
-        cert_dict = ssock.getpeercert()
-        cert_bin = ssock.getpeercert(binary_form=True)
-
-print(f"TLS version: {tls_version}")
-print("Certificate:")
-print(cert_dict)
-
-# NOTE: peer and untrusted_intermediates are Certificate and
-# list[Certificate] respectively, and should be loaded from the
-# application context that needs them verified, such as a
-# TLS socket.
-peer = load_der_x509_certificate(cert_bin)
-untrusted_intermediates = [load_pem_x509_certificate(cert.encode()) for cert in chain_certs[1:]]
-chain = verifier.verify(peer, untrusted_intermediates)
-print(chain)
-for i, cert in enumerate(chain):
-    with open(f"ssl-cert-chain-{i}.pem", "w") as f:
-        f.write(cert.public_bytes(serialization.Encoding.PEM).decode())
+if __name__ == "__main__":
+    sys.exit(main())
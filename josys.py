@@ -1,34 +1,264 @@
 #!/usr/bin/env python3
 
 import argparse
+import hashlib
+import os
+import re
+import shutil
+import subprocess
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import attrs
 from path import Path
 
+# same pipeline as yosys-opt
+DEFAULT_PASSES = ["proc", "opt_clean", "opt"]
+INCLUDE_RE = re.compile(rb'^\s*`include\s+"([^"]+)"', re.MULTILINE)
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path("~/.cache").expanduser()
+    return Path(cache_home) / "josys"
+
+
+def quote(arg: object) -> str:
+    # yosys splits commands on whitespace unless the argument is double quoted
+    s = str(arg)
+    if '"' in s:
+        raise ValueError(f"can't pass a path containing '\"' to yosys: {s}")
+    return f'"{s}"'
+
+
+def resolve_include(name: str, including: Path, include_dirs: list[Path]) -> Path | None:
+    # like the yosys preprocessor: next to the including file, then the -I dirs, then the cwd
+    for d in (including.parent, *include_dirs, Path()):
+        cand = d / name
+        if cand.is_file():
+            return cand
+    return None
+
+
+@attrs.define
+class SynthJob:
+    name: str
+    sources: list[Path]
+    top: str | None = None
+    include_dirs: list[Path] = attrs.field(factory=list)
+    defines: list[str] = attrs.field(factory=list)
+
+    def script(self, passes: list[str], out_file: Path) -> str:
+        # separate -I/-D arguments, yosys only strips quotes around a whole token
+        read_args = [f"-I {quote(d)}" for d in self.include_dirs]
+        read_args += [f"-D {quote(d)}" for d in self.defines]
+        read_args += [quote(s) for s in self.sources]
+        cmds = ["read_verilog " + " ".join(read_args)]
+        if self.top is not None:
+            cmds.append(f"hierarchy -check -top {self.top}")
+        else:
+            cmds.append("hierarchy -check -auto-top")
+        cmds += passes
+        cmds.append(f"write_verilog {quote(out_file)}")
+        return "; ".join(cmds)
+
+    def cache_key(self, yosys_version: str, passes: list[str]) -> str:
+        h = hashlib.sha256()
+        h.update(yosys_version.encode())
+        h.update(b"\0".join(p.encode() for p in passes))
+        h.update(b"\0top:" + (self.top or "").encode())
+        for d in self.include_dirs:
+            h.update(b"\0incdir:" + str(d).encode())
+        for d in self.defines:
+            h.update(b"\0define:" + d.encode())
+        # sources plus every file they `include, transitively. Includes named through a macro
+        # can't be followed, use --no-cache for designs relying on those.
+        pending = list(self.sources)
+        seen = set()
+        while pending:
+            src = pending.pop(0)
+            data = src.read_bytes()
+            h.update(b"\0src:" + str(src).encode() + b"\0")
+            h.update(data)
+            for m in INCLUDE_RE.finditer(data):
+                name = m.group(1).decode()
+                inc = resolve_include(name, src, self.include_dirs)
+                if inc is None:
+                    h.update(b"\0missing:" + m.group(1))
+                elif inc.realpath() not in seen:
+                    seen.add(inc.realpath())
+                    pending.append(inc)
+        return h.hexdigest()
+
+
+@attrs.define
+class SynthResult:
+    job: SynthJob
+    out_file: Path
+    cached: bool
+    error: str | None = None
+
+
+def get_yosys_version(yosys: str) -> str:
+    return subprocess.check_output([yosys, "-V"], text=True).strip()
+
+
+def run_job(
+    job: SynthJob,
+    yosys: str,
+    yosys_version: str,
+    passes: list[str],
+    cache_dir: Path | None,
+    out_prefix: Path,
+) -> SynthResult:
+    out_file = Path(f"{out_prefix}{job.name}.v")
+    # a bare prefix like "opt_" has no directory part to create
+    if out_file.parent:
+        out_file.parent.makedirs_p()
+    entry = None
+    if cache_dir is not None:
+        entry = cache_dir / job.cache_key(yosys_version, passes)
+        if (entry / "out.v").is_file():
+            shutil.copyfile(entry / "out.v", out_file)
+            return SynthResult(job, out_file, cached=True)
+        cache_dir.makedirs_p()
+    work_dir = Path(tempfile.mkdtemp(prefix="josys-", dir=cache_dir))
+    try:
+        work_out = work_dir / "out.v"
+        proc = subprocess.run(
+            [yosys, "-q", "-l", work_dir / "yosys.log", "-p", job.script(passes, work_out)],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if proc.returncode != 0:
+            return SynthResult(job, out_file, cached=False, error=proc.stderr or proc.stdout)
+        shutil.copyfile(work_out, out_file)
+        if entry is not None:
+            try:
+                work_dir.rename(entry)
+            except OSError:
+                pass  # a concurrent identical job published it first
+    finally:
+        work_dir.rmtree_p()
+    return SynthResult(job, out_file, cached=False)
+
+
+def get_jobs(
+    in_files: list[Path],
+    tops: list[str] | None,
+    include_dirs: list[Path] | None = None,
+    defines: list[str] | None = None,
+) -> list[SynthJob]:
+    opts = {"include_dirs": include_dirs or [], "defines": defines or []}
+    if tops:
+        jobs = [SynthJob(top, in_files, top, **opts) for top in tops]
+    else:
+        jobs = [SynthJob(f.stem, [f], **opts) for f in in_files]
+    # job names pick the output file, parallel jobs must not write the same one
+    names: dict[str, SynthJob] = {}
+    for job in jobs:
+        if job.name in names:
+            raise ValueError(
+                f"jobs {names[job.name].sources[0]} and {job.sources[0]} would both write "
+                f"{job.name}.v, rename one or use --top"
+                if not tops
+                else f"duplicate --top {job.name}"
+            )
+        names[job.name] = job
+    return jobs
+
+
+def read_passes(script: Path | None) -> list[str]:
+    if script is None:
+        return DEFAULT_PASSES
+    passes = []
+    for line in script.read_text().splitlines():
+        line = line.split("#", 1)[0].strip()
+        if line:
+            passes.append(line)
+    return passes
+
 
 def real_main(args) -> int:
     assert args.in_file is not None
-    assert args.out_file is not None
-    in_buf = open(args.in_file, "rb").read()
-    out_buf = bytearray(len(in_buf) * 8)
-    for i, b in enumerate(in_buf):
-        for j in range(8):
-            out_buf[i * 8 + j] = b & 1
-            b >>= 1
-    open(args.out_file, "wb").write(out_buf)
-    return 0
+    assert args.out_prefix is not None
+    jobs = get_jobs(args.in_file, args.top, args.include_dir, args.define)
+    passes = read_passes(args.script)
+    yosys_version = get_yosys_version(args.yosys)
+    cache_dir = None if args.no_cache else args.cache_dir
+    nfailed = 0
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        futs = [
+            pool.submit(run_job, job, args.yosys, yosys_version, passes, cache_dir, args.out_prefix)
+            for job in jobs
+        ]
+        for fut in as_completed(futs):
+            res = fut.result()
+            if res.error is not None:
+                nfailed += 1
+                print(f"FAIL   {res.job.name}:\n{res.error}", file=sys.stderr)
+            else:
+                print(f"{'cached' if res.cached else 'synth '} {res.job.name} => {res.out_file}")
+    return 1 if nfailed else 0
 
 
 def get_arg_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(description="yosys wrapper")
-    parser.add_argument("-i", "--in-file", required=True, type=Path, help="Input path")
+    parser = argparse.ArgumentParser(description="yosys wrapper - cached, parallel batch synth")
+    parser.add_argument(
+        "-i",
+        "--in-file",
+        required=True,
+        type=Path,
+        action="append",
+        help="Input verilog path, one job per file unless --top is given",
+    )
     parser.add_argument("-o", "--out-prefix", required=True, type=Path, help="Output path prefix")
-    parser.add_argument("-t", "--top", required=True, help="top level module")
+    parser.add_argument(
+        "-t",
+        "--top",
+        action="append",
+        help="top level module, one job per top over all input files",
+    )
+    parser.add_argument(
+        "-I",
+        "--include-dir",
+        type=Path,
+        action="append",
+        help="`include search directory, passed to read_verilog",
+    )
+    parser.add_argument(
+        "-D", "--define", action="append", help="NAME[=VALUE] define, passed to read_verilog"
+    )
+    parser.add_argument(
+        "-s",
+        "--script",
+        type=Path,
+        help="yosys pass script, one pass per line (default: proc; opt_clean; opt)",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count(), help="Number of concurrent yosys runs"
+    )
+    parser.add_argument("-y", "--yosys", default="yosys", help="yosys executable")
+    parser.add_argument(
+        "-c", "--cache-dir", type=Path, default=default_cache_dir(), help="Synth result cache"
+    )
+    parser.add_argument(
+        "-C",
+        "--no-cache",
+        action="store_true",
+        help="Always re-synthesize, needed if `include file names come from macros",
+    )
     return parser
 
 
 def main() -> int:
-    return real_main(get_arg_parser().parse_args())
+    parser = get_arg_parser()
+    args = parser.parse_args()
+    try:
+        return real_main(args)
+    except ValueError as e:
+        parser.error(str(e))
 
 
 if __name__ == "__main__":
@@ -1,18 +1,61 @@
 #!/usr/bin/env python3
 
+import argparse
+import contextlib
 import io
 import sys
 import unittest
+from collections.abc import Iterable
+from typing import BinaryIO
 
+_HEX_DIGITS = b"0123456789abcdefABCDEF"
+# deletes everything but hex digits in a single bytes.translate() pass
+_NON_HEX_DIGITS = bytes(sorted(set(range(256)) - set(_HEX_DIGITS)))
+LINE_BATCH_SIZE = 1024 * 1024
 
-def normalize_uuid(raw_uuid: str) -> str:
-    stripped_uuid = "".join(filter(lambda c: c in "0123456789abcdefABCDEF", raw_uuid))
-    if len(stripped_uuid) != 32:
+
+def normalize_uuid_bytes(raw_uuid: bytes) -> bytes:
+    u = raw_uuid.translate(None, _NON_HEX_DIGITS)
+    if len(u) != 32:
         raise ValueError("Length of UUID is not 32 hex nibbles")
     # example format: AA5A6FE0-9E4C-3611-9B8D-A4D55923C105
     # 8-4-4-4-12 chars
-    u = stripped_uuid
-    return f"{u[0 : 0 + 8]}-{u[8 : 8 + 4]}-{u[12 : 12 + 4]}-{u[16 : 16 + 4]}-{u[20 : 20 + 12]}"
+    return b"-".join((u[0:8], u[8:12], u[12:16], u[16:20], u[20:32]))
+
+
+def normalize_uuid(raw_uuid: str) -> str:
+    return normalize_uuid_bytes(raw_uuid.encode("ascii", "ignore")).decode()
+
+
+def normalize_uuid_stream(inf: BinaryIO, outf: BinaryIO, name: str) -> int:
+    """Normalize one UUID per line of inf into outf, returns the number of bad lines."""
+    nbad = 0
+    lineno = 0
+    while lines := inf.readlines(LINE_BATCH_SIZE):
+        out: list[bytes] = []
+        for line in lines:
+            lineno += 1
+            if not line.strip():
+                continue
+            try:
+                out.append(normalize_uuid_bytes(line))
+            except ValueError as e:
+                print(f"{name}:{lineno}: {e}: {line.rstrip()!r}", file=sys.stderr)
+                nbad += 1
+        if out:
+            outf.write(b"\n".join(out) + b"\n")
+    return nbad
+
+
+def normalize_uuid_files(paths: Iterable[str], outf: BinaryIO) -> int:
+    nbad = 0
+    for pth in paths:
+        if pth == "-":
+            nbad += normalize_uuid_stream(sys.stdin.buffer, outf, "<stdin>")
+            continue
+        with open(pth, "rb") as inf:
+            nbad += normalize_uuid_stream(inf, outf, pth)
+    return nbad
 
 
 class NormalizeUUIDTest(unittest.TestCase):
@@ -33,23 +76,60 @@ class NormalizeUUIDTest(unittest.TestCase):
             normalize_uuid("its duck season")
         self.assertTrue("Length of UUID is not 32 hex nibbles" in str(context.exception))
 
+    def test_stream(self):
+        inf = io.BytesIO(
+            b"DE/DFA0F03B6D397D85C1AE074F8BD68B\n\nnope\naa5a6fe09e4c36119b8da4d55923c105"
+        )
+        outf = io.BytesIO()
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(normalize_uuid_stream(inf, outf, "test"), 1)
+        self.assertEqual(
+            outf.getvalue(),
+            b"DEDFA0F0-3B6D-397D-85C1-AE074F8BD68B\naa5a6fe0-9e4c-3611-9b8d-a4d55923c105\n",
+        )
 
-assert normalize_uuid("DE/DFA0F03B6D397D85C1AE074F8BD68B") == "DEDFA0F0-3B6D-397D-85C1-AE074F8BD68B"
-assert (
-    normalize_uuid("AA5A6FE0-9E4C-3611-9B8D-A4D55923C105") == "AA5A6FE0-9E4C-3611-9B8D-A4D55923C105"
-)
 
-suite = unittest.defaultTestLoader.loadTestsFromTestCase(NormalizeUUIDTest)
-test_text = io.StringIO()
-runner = unittest.TextTestRunner(stream=test_text)
-test_result = runner.run(suite)
-if not test_result.wasSuccessful():
+def self_test() -> int:
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(NormalizeUUIDTest)
+    test_text = io.StringIO()
+    runner = unittest.TextTestRunner(stream=test_text)
+    test_result = runner.run(suite)
     print(test_text.getvalue(), file=sys.stderr)
-    print("self-test failed, exiting", file=sys.stderr)
-    sys.exit(-2)
+    if not test_result.wasSuccessful():
+        print("self-test failed, exiting", file=sys.stderr)
+        return -2
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Normalize Mach-O UUIDs to 8-4-4-4-12 form")
+    parser.add_argument("uuids", metavar="UUID", nargs="*", help="Unformatted UUID")
+    parser.add_argument(
+        "-i",
+        "--input",
+        metavar="FILE",
+        action="append",
+        default=[],
+        help="Normalize one UUID per line of FILE ('-' for stdin), stdin if no UUIDs are given",
+    )
+    parser.add_argument("--self-test", action="store_true", help="Run the self-test and exit")
+    args = parser.parse_args()
+
+    if args.self_test:
+        return self_test()
+
+    for raw_uuid in args.uuids:
+        print(normalize_uuid(raw_uuid))
+    inputs = args.input
+    if not args.uuids and not inputs:
+        if sys.stdin.isatty():
+            parser.error("no UUIDs given on the command line or stdin")
+        inputs = ["-"]
+    if not inputs:
+        return 0
+    sys.stdout.flush()
+    return 1 if normalize_uuid_files(inputs, sys.stdout.buffer) else 0
 
-if len(sys.argv) != 2:
-    print("usage: macho-format-uuid.py <unformatted UUID>")
-    sys.exit(-1)
 
-print(normalize_uuid(sys.argv[1]))
+if __name__ == "__main__":
+    sys.exit(main())
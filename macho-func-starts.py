@@ -1,19 +1,207 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 
+import argparse
+import mmap
+import struct
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
-import lief
+import attrs
+from path import Path
 
-binary = lief.parse(sys.argv[1])
+FAT_MAGIC = 0xCAFEBABE
+FAT_MAGIC_64 = 0xCAFEBABF
+MH_MAGIC = 0xFEEDFACE
+MH_MAGIC_64 = 0xFEEDFACF
+MH_CIGAM = 0xCEFAEDFE
+MH_CIGAM_64 = 0xCFFAEDFE
 
-assert binary.format == lief.EXE_FORMATS.MACHO
+LC_SEGMENT = 0x1
+LC_SEGMENT_64 = 0x19
+LC_FUNCTION_STARTS = 0x26
 
-funcs = binary.function_starts.functions
+# fat magic is shared with Java class files, whose "nfat_arch" is their version and >= 45
+MAX_FAT_ARCHS = 44
 
-if binary.abstract.header.is_32:
-    fmt_str = "{:08x}"
-else:
-    fmt_str = "{:016x}"
+CPU_TYPE_NAMES = {
+    7: "i386",
+    0x01000007: "x86_64",
+    12: "arm",
+    0x0100000C: "arm64",
+    0x0200000C: "arm64_32",
+    18: "ppc",
+    0x01000012: "ppc64",
+}
+CPU_SUBTYPE_ARM64E = 2
 
-for func in funcs:
-    print(fmt_str.format(int(func)))
+
+class NotMachOError(ValueError):
+    pass
+
+
+@attrs.define
+class MachOSlice:
+    arch: str
+    is_64: bool
+    text_vmaddr: int
+    func_offsets: list[int]
+
+    @property
+    def func_addrs(self) -> list[int]:
+        return [self.text_vmaddr + off for off in self.func_offsets]
+
+
+def arch_name(cputype: int, cpusubtype: int) -> str:
+    name = CPU_TYPE_NAMES.get(cputype, f"cpu{cputype:#x}")
+    if name == "arm64" and cpusubtype & 0xFF == CPU_SUBTYPE_ARM64E:
+        name = "arm64e"
+    return name
+
+
+def decode_function_starts(buf: bytes | mmap.mmap, start: int, end: int) -> list[int]:
+    """Decode the zero terminated ULEB128 deltas of LC_FUNCTION_STARTS into __TEXT offsets."""
+    offsets: list[int] = []
+    off = 0
+    delta = 0
+    shift = 0
+    for b in buf[start:end]:
+        delta |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        if delta == 0:
+            break
+        off += delta
+        offsets.append(off)
+        delta = 0
+        shift = 0
+    return offsets
+
+
+def parse_macho_slice(buf: bytes | mmap.mmap, base: int) -> MachOSlice:
+    (magic,) = struct.unpack_from("<I", buf, base)
+    if magic in (MH_MAGIC, MH_MAGIC_64):
+        endian = "<"
+    elif magic in (MH_CIGAM, MH_CIGAM_64):
+        endian = ">"
+    else:
+        raise NotMachOError(f"bad Mach-O magic {magic:#010x} at {base:#x}")
+    is_64 = magic in (MH_MAGIC_64, MH_CIGAM_64)
+    _, cputype, cpusubtype, _, ncmds, _, _ = struct.unpack_from(f"{endian}7I", buf, base)
+    lc_off = base + (32 if is_64 else 28)
+    text_vmaddr = 0
+    fs_dataoff = fs_datasize = None
+    for _ in range(ncmds):
+        cmd, cmdsize = struct.unpack_from(f"{endian}2I", buf, lc_off)
+        if cmd == LC_SEGMENT_64:
+            segname, vmaddr = struct.unpack_from(f"{endian}16sQ", buf, lc_off + 8)
+            if segname.rstrip(b"\0") == b"__TEXT":
+                text_vmaddr = vmaddr
+        elif cmd == LC_SEGMENT:
+            segname, vmaddr = struct.unpack_from(f"{endian}16sI", buf, lc_off + 8)
+            if segname.rstrip(b"\0") == b"__TEXT":
+                text_vmaddr = vmaddr
+        elif cmd == LC_FUNCTION_STARTS:
+            fs_dataoff, fs_datasize = struct.unpack_from(f"{endian}2I", buf, lc_off + 8)
+        if cmdsize < 8:
+            raise ValueError(f"bad load command size {cmdsize} at {lc_off:#x}")
+        lc_off += cmdsize
+    func_offsets: list[int] = []
+    if fs_dataoff is not None and fs_datasize is not None:
+        fs_start = base + fs_dataoff
+        func_offsets = decode_function_starts(buf, fs_start, fs_start + fs_datasize)
+    return MachOSlice(arch_name(cputype, cpusubtype), is_64, text_vmaddr, func_offsets)
+
+
+def parse_macho(buf: bytes | mmap.mmap) -> list[MachOSlice]:
+    if len(buf) < 8:
+        raise NotMachOError("too small to be a Mach-O")
+    magic, nfat_arch = struct.unpack_from(">2I", buf, 0)
+    if magic not in (FAT_MAGIC, FAT_MAGIC_64):
+        return [parse_macho_slice(buf, 0)]
+    if nfat_arch > MAX_FAT_ARCHS:
+        raise NotMachOError("Java class file, not a fat Mach-O")
+    slices = []
+    for i in range(nfat_arch):
+        if magic == FAT_MAGIC_64:
+            _, _, offset, _, _, _ = struct.unpack_from(">2I2Q2I", buf, 8 + i * 32)
+        else:
+            _, _, offset, _, _ = struct.unpack_from(">5I", buf, 8 + i * 20)
+        slices.append(parse_macho_slice(buf, offset))
+    return slices
+
+
+def function_starts_for_file(pth: Path) -> tuple[Path, list[MachOSlice] | None, str | None]:
+    try:
+        with open(pth, "rb") as f:
+            if not pth.size:
+                raise NotMachOError("empty file")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return pth, parse_macho(mm), None
+    except NotMachOError as e:
+        return pth, None, str(e)
+    except (OSError, ValueError, struct.error) as e:
+        return pth, None, f"{type(e).__name__}: {e}"
+
+
+def get_files(paths: list[Path]) -> list[Path]:
+    files: list[Path] = []
+    for pth in paths:
+        if pth.is_dir():
+            files += sorted(f for f in pth.walkfiles() if not f.islink())
+        else:
+            files.append(pth)
+    return files
+
+
+def real_main(args: argparse.Namespace) -> int:
+    paths: list[Path] = args.paths
+    explicit_files = {p for p in paths if not p.is_dir()}
+    files = get_files(paths)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(function_starts_for_file, files, chunksize=16))
+    nslices = sum(len(slices) for _, slices, _ in results if slices is not None)
+    show_headers = nslices > 1
+    rc = 0
+    out: list[str] = []
+    for pth, slices, err in results:
+        if slices is None:
+            # walking directories hits plenty of non-Mach-O files, only complain about named ones
+            if pth in explicit_files:
+                print(f"{pth}: {err}", file=sys.stderr)
+                rc = 1
+            continue
+        for sl in slices:
+            if show_headers:
+                out.append(f"==> {pth} [{sl.arch}] <==")
+            width = 16 if sl.is_64 else 8
+            vals = sl.func_addrs if args.addresses else sl.func_offsets
+            out += [f"{v:0{width}x}" for v in vals]
+    if out:
+        sys.stdout.write("\n".join(out) + "\n")
+    return rc
+
+
+def get_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Dump LC_FUNCTION_STARTS of Mach-O files, fat slices and directory trees"
+    )
+    parser.add_argument(
+        "paths", nargs="+", type=Path, metavar="PATH", help="Mach-O files or directories"
+    )
+    parser.add_argument(
+        "-a",
+        "--addresses",
+        action="store_true",
+        help="Print absolute vmaddrs instead of offsets from the __TEXT segment",
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes")
+    return parser
+
+
+def main() -> int:
+    return real_main(get_arg_parser().parse_args())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,16 +2,109 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import json
+import os
+import re
+import socket
+import socketserver
+import sqlite3
+import sys
+from collections.abc import Iterable, Iterator
+from fnmatch import fnmatch
+from typing import TYPE_CHECKING, Any, TextIO
 
+import attrs
 from path import Path
-from transformers import AutoTokenizer
 
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
 
-def get_files(paths: list[Path]) -> set[Path]:
+
+def default_cache_path() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path("~/.cache").expanduser()
+    return Path(cache_home) / "tokc" / "token-counts.sqlite3"
+
+
+def default_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or default_cache_path().parent
+    return Path(runtime_dir) / "tokc.sock"
+
+
+@attrs.define
+class CountOptions:
+    stream: bool = False
+    exact: bool = False
+    chunk_size: int = 1024 * 1024
+    overlap: int = 4096
+
+    @property
+    def cache_tag(self) -> str:
+        # approximate counts depend on where chunks were cut, keep them apart from exact ones
+        if self.stream and not self.exact:
+            return f"+stream{self.chunk_size}"
+        return ""
+
+
+class TokenCountCache:
+    """Persistent per-file token counts keyed by (model, tokenizer revision, content hash)."""
+
+    def __init__(self, db_path: Path) -> None:
+        if db_path.parent:
+            db_path.parent.makedirs_p()
+        self.db = sqlite3.connect(db_path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS token_counts ("
+            "model TEXT NOT NULL, revision TEXT NOT NULL, digest TEXT NOT NULL, "
+            "ntok INTEGER NOT NULL, PRIMARY KEY (model, revision, digest))"
+        )
+
+    def get(self, model: str, revision: str, digest: str) -> int | None:
+        row = self.db.execute(
+            "SELECT ntok FROM token_counts WHERE model = ? AND revision = ? AND digest = ?",
+            (model, revision, digest),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, model: str, revision: str, digest: str, ntok: int) -> None:
+        self.db.execute(
+            "INSERT OR REPLACE INTO token_counts VALUES (?, ?, ?, ?)",
+            (model, revision, digest, ntok),
+        )
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def close(self) -> None:
+        self.commit()
+        self.db.close()
+
+
+def _glob_match(rel: Path, pattern: str) -> bool:
+    if fnmatch(rel, pattern):
+        return True
+    return any(fnmatch(part, pattern) for part in rel.splitall()[1:])
+
+
+def want_file(rel: Path, include: list[str], exclude: list[str]) -> bool:
+    if any(_glob_match(rel, pat) for pat in exclude):
+        return False
+    return not include or any(_glob_match(rel, pat) for pat in include)
+
+
+def get_files(
+    paths: list[Path],
+    recursive: bool = False,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+) -> set[Path]:
+    include = include or []
+    exclude = exclude or []
     files: list[Path] = []
     for pth in paths:
         if pth.is_dir():
-            files += pth.files()
+            children = pth.walkfiles() if recursive else pth.files()
+            files += [f for f in children if want_file(f.relpath(pth), include, exclude)]
         elif pth.is_file():
             files.append(pth)
         else:
@@ -19,40 +112,527 @@ def get_files(paths: list[Path]) -> set[Path]:
     return set(files)
 
 
-def count_tokens(paths: list[Path], model: str) -> None:
-    files = get_files(paths)
-    tokenizer = AutoTokenizer.from_pretrained(model)
-    ntok = 0
+def find_tokenizer_json(model: str) -> Path | None:
+    pth = Path(model)
+    if pth.is_file():
+        return pth
+    if (pth / "tokenizer.json").is_file():
+        return pth / "tokenizer.json"
+    return None
+
+
+def model_identity(model: str) -> str:
+    """What -m refers to, the same for a daemon and its clients whatever the spelling or cwd."""
+    tokenizer_json = find_tokenizer_json(model)
+    if tokenizer_json is not None:
+        return "sha256:" + hashlib.sha256(tokenizer_json.read_bytes()).hexdigest()
+    if Path(model).exists():
+        # a local transformers tokenizer directory without a tokenizer.json
+        return str(Path(model).realpath())
+    return model
+
+
+@attrs.define
+class SlowEncoding:
+    ids: list[int]
+
+
+class SlowTokenizer:
+    """The parts of tokenizers.Tokenizer used here, over a slow (python) transformers tokenizer.
+
+    There are no offsets or pre-tokenizer, so exact streaming counts whole files instead.
+    """
+
+    pre_tokenizer = None
+
+    def __init__(self, hf_tokenizer: Any) -> None:
+        self.hf_tokenizer = hf_tokenizer
+
+    def encode(self, s: str, add_special_tokens: bool = True) -> SlowEncoding:
+        return SlowEncoding(self.hf_tokenizer.encode(s, add_special_tokens=add_special_tokens))
+
+    def num_special_tokens_to_add(self, is_pair: bool) -> int:
+        return self.hf_tokenizer.num_special_tokens_to_add(pair=is_pair)
+
+    def no_truncation(self) -> None:
+        # silences the "sequence length is longer than the specified maximum" warning
+        self.hf_tokenizer.model_max_length = sys.maxsize
+
+    def no_padding(self) -> None:
+        pass
+
+    def to_str(self) -> str:
+        vocab = json.dumps(self.hf_tokenizer.get_vocab(), sort_keys=True)
+        return f"{type(self.hf_tokenizer).__name__}\0{vocab}"
+
+
+def load_tokenizer(model: str) -> tuple[Tokenizer | SlowTokenizer, str]:
+    # imports are deferred so daemon clients and --help never pay for them
+    tokenizer_json = find_tokenizer_json(model)
+    if tokenizer_json is not None:
+        from tokenizers import Tokenizer
+
+        tokenizer = Tokenizer.from_file(tokenizer_json)
+        revision = hashlib.sha256(tokenizer_json.read_bytes()).hexdigest()
+    else:
+        from transformers import AutoTokenizer
+
+        hf_tokenizer = AutoTokenizer.from_pretrained(model)
+        if hf_tokenizer.is_fast:
+            tokenizer = hf_tokenizer.backend_tokenizer
+        else:
+            tokenizer = SlowTokenizer(hf_tokenizer)
+        # unversioned tokenizers get a fingerprint of their serialized form instead
+        revision = (
+            hf_tokenizer.init_kwargs.get("_commit_hash")
+            or hashlib.sha256(tokenizer.to_str().encode()).hexdigest()
+        )
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer, revision
+
+
+def count_str_tokens(tokenizer: Tokenizer, s: str) -> int:
+    return len(tokenizer.encode(s).ids)
+
+
+# Streaming mode tokenizes each chunk on its own. Chunks are preferably cut right after a newline
+# that is followed by non-whitespace, else right before a whitespace character that follows a
+# non-whitespace one, and only if the whole search window has no whitespace at all is a chunk hard
+# cut. For byte-level BPE tokenizers with regex pre-tokenizers (GPT-2, Llama 3, Qwen) no
+# pre-token spans a newline cut, so those are exact. A whitespace cut can only split a punctuation
+# pre-token that swallows trailing newlines and over-counts by at most one token. Hard cuts and
+# SentencePiece-style tokenizers (which prepend a dummy prefix space per chunk) may be off by a
+# few tokens per cut. The total error is therefore bounded by a small multiple of the number of
+# cuts, which is reported. Exact mode instead carries the tail of each chunk into the next one and
+# only counts the tokens before a pre-token boundary at least `overlap` characters from the
+# end of the buffer, which matches whole-file tokenization as long as no single pre-token is
+# longer than `overlap` characters.
+CUT_SEARCH_WINDOW = 64 * 1024
+_NEWLINE_CUT_RE = re.compile(r"\n(?=\S)")
+_SPACE_CUT_RE = re.compile(r"\S(?=\s)")
+
+
+def _find_cut(buf: str) -> int | None:
+    search_start = max(0, len(buf) - CUT_SEARCH_WINDOW)
+    for pat in (_NEWLINE_CUT_RE, _SPACE_CUT_RE):
+        last_match = None
+        for last_match in pat.finditer(buf, search_start):
+            pass
+        if last_match is not None:
+            return last_match.end()
+    return None
+
+
+def iter_text_chunks(fh: TextIO, chunk_size: int) -> Iterator[str]:
+    carry = ""
+    while chunk := fh.read(chunk_size):
+        buf = carry + chunk
+        cut = _find_cut(buf)
+        if cut is None:
+            cut = len(buf)
+        yield buf[:cut]
+        carry = buf[cut:]
+    if carry:
+        yield carry
+
+
+def count_stream_tokens(tokenizer: Tokenizer, fh: TextIO, chunk_size: int) -> tuple[int, int]:
+    ntok = tokenizer.num_special_tokens_to_add(False)
+    nchunks = 0
+    for chunk in iter_text_chunks(fh, chunk_size):
+        ntok += len(tokenizer.encode(chunk, add_special_tokens=False).ids)
+        nchunks += 1
+    return ntok, max(nchunks - 1, 0)
+
+
+def _stable_cut(tokenizer: Tokenizer, buf: str, overlap: int) -> int:
+    limit = len(buf) - overlap
+    if limit <= 0:
+        return 0
+    pre_tokenizer = tokenizer.pre_tokenizer
+    if pre_tokenizer is None:
+        starts = [s for s, _ in tokenizer.encode(buf, add_special_tokens=False).offsets]
+    else:
+        starts = [s for _, (s, _) in pre_tokenizer.pre_tokenize_str(buf)]
+    last_start = 0
+    for start in starts:
+        if start >= limit:
+            return start
+        last_start = start
+    return last_start
+
+
+def count_stream_tokens_exact(
+    tokenizer: Tokenizer, fh: TextIO, chunk_size: int, overlap: int
+) -> int:
+    ntok = tokenizer.num_special_tokens_to_add(False)
+    carry = ""
+    while chunk := fh.read(chunk_size):
+        buf = carry + chunk
+        cut = _stable_cut(tokenizer, buf, overlap)
+        if cut == 0:
+            carry = buf
+            continue
+        ntok += len(tokenizer.encode(buf[:cut], add_special_tokens=False).ids)
+        carry = buf[cut:]
+    if carry:
+        ntok += len(tokenizer.encode(carry, add_special_tokens=False).ids)
+    return ntok
+
+
+def count_file_tokens(tokenizer: Tokenizer, f: Path, opts: CountOptions) -> tuple[int, int]:
+    if not opts.stream:
+        return count_str_tokens(tokenizer, f.read_bytes().decode(errors="replace")), 0
+    with open(f, errors="replace") as fh:
+        if opts.exact and isinstance(tokenizer, SlowTokenizer):
+            return count_str_tokens(tokenizer, fh.read()), 0
+        if opts.exact:
+            return count_stream_tokens_exact(tokenizer, fh, opts.chunk_size, opts.overlap), 0
+        return count_stream_tokens(tokenizer, fh, opts.chunk_size)
+
+
+@attrs.define
+class FileTokenCount:
+    path: Path = attrs.field(converter=Path)
+    nbytes: int
+    ntok: int
+    ncuts: int = 0
+
+    @property
+    def bytes_per_token(self) -> float:
+        return self.nbytes / self.ntok if self.ntok else 0.0
+
+
+def count_files(
+    tokenizer: Tokenizer,
+    model: str,
+    revision: str,
+    files: Iterable[Path],
+    cache: TokenCountCache | None,
+    opts: CountOptions,
+) -> list[FileTokenCount]:
+    revision += opts.cache_tag
+    counts: list[FileTokenCount] = []
     for f in files:
-        with open(f) as fh:
-            fstr = fh.read()
-            toks = tokenizer(fstr)
-            ntok += len(toks["input_ids"])
-    print(f"num_tokens: {ntok}")
+        with open(f, "rb") as fh:
+            digest = hashlib.file_digest(fh, "sha256").hexdigest()
+            nbytes = fh.tell()
+        fntok = cache.get(model, revision, digest) if cache is not None else None
+        fncuts = 0
+        if fntok is None:
+            fntok, fncuts = count_file_tokens(tokenizer, f, opts)
+            if cache is not None:
+                cache.put(model, revision, digest, fntok)
+        counts.append(FileTokenCount(f, nbytes, fntok, fncuts))
+    return counts
+
+
+def print_counts(counts: list[FileTokenCount], opts: CountOptions) -> None:
+    print(f"num_tokens: {sum(c.ntok for c in counts)}")
+    if opts.stream and not opts.exact:
+        ncuts = sum(c.ncuts for c in counts)
+        print(f"num_chunk_cuts: {ncuts} (approximate, error bounded by a few tokens per cut)")
+
+
+def _rollup_dirs_for(f: Path, roots: list[Path]) -> list[Path]:
+    for root in roots:
+        if root.is_dir() and f.startswith(root.rstrip(os.sep) + os.sep):
+            rel_parts = f.relpath(root).parent.splitall()[1:]
+            return [root.joinpath(*rel_parts[:i]).normpath() for i in range(len(rel_parts) + 1)]
+    return [f.parent.normpath()]
+
+
+def rollup_dirs(counts: list[FileTokenCount], roots: list[Path]) -> list[FileTokenCount]:
+    """Sum counts into every directory between each file and the root it was found under."""
+    dirs: dict[Path, FileTokenCount] = {}
+    for c in counts:
+        for d in _rollup_dirs_for(c.path, roots):
+            rollup = dirs.setdefault(d, FileTokenCount(d, 0, 0))
+            rollup.nbytes += c.nbytes
+            rollup.ntok += c.ntok
+            rollup.ncuts += c.ncuts
+    return list(dirs.values())
+
+
+def _count_dict(c: FileTokenCount) -> dict[str, Any]:
+    return {
+        "path": str(c.path),
+        "bytes": c.nbytes,
+        "tokens": c.ntok,
+        "bytes_per_token": round(c.bytes_per_token, 3),
+    }
+
+
+def print_report(
+    counts: list[FileTokenCount], roots: list[Path], report: str, top: int, opts: CountOptions
+) -> None:
+    by_tokens = sorted(counts, key=lambda c: (-c.ntok, c.path))
+    dirs = sorted(rollup_dirs(counts, roots), key=lambda c: (-c.ntok, c.path))
+    total = FileTokenCount(
+        Path(),
+        sum(c.nbytes for c in counts),
+        sum(c.ntok for c in counts),
+        sum(c.ncuts for c in counts),
+    )
+    if report == "json":
+        doc = {
+            "num_tokens": total.ntok,
+            "num_bytes": total.nbytes,
+            "bytes_per_token": round(total.bytes_per_token, 3),
+            "files": [_count_dict(c) for c in by_tokens],
+            "directories": [_count_dict(c) for c in dirs],
+            "top": [str(c.path) for c in by_tokens[:top]],
+        }
+        if opts.stream and not opts.exact:
+            doc["num_chunk_cuts"] = total.ncuts
+        print(json.dumps(doc, indent=2))
+        return
+
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+    for title, rows in (
+        (f"Top {top} files by tokens", by_tokens[:top]),
+        (f"Top {top} directories by tokens", dirs[:top]),
+    ):
+        table = Table(title=title)
+        table.add_column("Path", style="cyan")
+        table.add_column("Tokens", justify="right", style="magenta")
+        table.add_column("% of total", justify="right")
+        table.add_column("Bytes", justify="right")
+        table.add_column("Bytes/token", justify="right")
+        for c in rows:
+            pct = 100 * c.ntok / total.ntok if total.ntok else 0.0
+            table.add_row(
+                str(c.path), str(c.ntok), f"{pct:.1f}", str(c.nbytes), f"{c.bytes_per_token:.2f}"
+            )
+        console.print(table)
+    console.print(
+        f"{len(counts)} files, {total.nbytes} bytes, {total.ntok} tokens, "
+        f"{total.bytes_per_token:.2f} bytes/token"
+    )
+
+
+def count_tokens(
+    files: Iterable[Path], model: str, cache_path: Path | None, opts: CountOptions
+) -> list[FileTokenCount]:
+    tokenizer, revision = load_tokenizer(model)
+    cache = TokenCountCache(cache_path) if cache_path is not None else None
+    try:
+        return count_files(tokenizer, model, revision, files, cache, opts)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+class TokenCountServer(socketserver.UnixStreamServer):
+    """Keeps one tokenizer and the count cache resident for --client invocations."""
+
+    def __init__(self, socket_path: Path, model: str, cache_path: Path | None) -> None:
+        self.model = model
+        self.model_id = model_identity(model)
+        self.tokenizer, self.revision = load_tokenizer(model)
+        self.cache = TokenCountCache(cache_path) if cache_path is not None else None
+        if socket_path.parent:
+            socket_path.parent.makedirs_p()
+        socket_path.remove_p()
+        super().__init__(socket_path, TokenCountRequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        Path(self.server_address).remove_p()
+        if self.cache is not None:
+            self.cache.close()
+
+
+class TokenCountRequestHandler(socketserver.StreamRequestHandler):
+    server: TokenCountServer
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            req = json.loads(line)
+            srv = self.server
+            resp: dict[str, Any]
+            if req["model_id"] != srv.model_id:
+                resp = {
+                    "error": f"daemon serves model '{srv.model}' ({srv.model_id}), not "
+                    f"'{req['model']}' ({req['model_id']})"
+                }
+            else:
+                try:
+                    counts = count_files(
+                        srv.tokenizer,
+                        srv.model,
+                        srv.revision,
+                        map(Path, req["files"]),
+                        srv.cache,
+                        CountOptions(**req["options"]),
+                    )
+                    resp = {"counts": [[c.nbytes, c.ntok, c.ncuts] for c in counts]}
+                except OSError as e:
+                    resp = {"error": str(e)}
+                if srv.cache is not None:
+                    srv.cache.commit()
+            self.wfile.write(json.dumps(resp).encode() + b"\n")
+
+
+def serve(socket_path: Path, model: str, cache_path: Path | None) -> None:
+    with TokenCountServer(socket_path, model, cache_path) as srv:
+        print(f"tokc: serving '{model}' on {socket_path}")
+        try:
+            srv.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def count_tokens_via_daemon(
+    socket_path: Path, files: Iterable[Path], model: str, opts: CountOptions
+) -> list[FileTokenCount]:
+    files = list(files)
+    req = {
+        "model": model,
+        "model_id": model_identity(model),
+        "files": [str(f.absolute()) for f in files],
+        "options": attrs.asdict(opts),
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(req).encode() + b"\n")
+        with sock.makefile("rb") as rfile:
+            resp = json.loads(rfile.readline())
+    if "error" in resp:
+        raise RuntimeError(f"tokc daemon error: {resp['error']}")
+    return [FileTokenCount(f, *c) for f, c in zip(files, resp["counts"], strict=True)]
 
 
 def real_main(args: argparse.Namespace) -> None:
+    cache_path = None if args.no_cache else args.cache
+    if args.serve:
+        serve(args.socket, args.model, cache_path)
+        return
     paths: list[Path] = args.paths
-    count_tokens(paths, args.model)
+    files = get_files(paths, recursive=args.recursive, include=args.include, exclude=args.exclude)
+    opts = CountOptions(
+        stream=args.stream or args.exact,
+        exact=args.exact,
+        chunk_size=args.chunk_size,
+        overlap=args.overlap,
+    )
+    if args.client:
+        counts = count_tokens_via_daemon(args.socket, files, args.model, opts)
+    else:
+        counts = count_tokens(files, args.model, cache_path, opts)
+    if args.report is not None:
+        print_report(counts, paths, args.report, args.top, opts)
+    else:
+        print_counts(counts, opts)
 
 
 def get_arg_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="tokc - count model tokens in files")
     parser.add_argument(
         "paths",
-        nargs="+",
+        nargs="*",
         type=Path,
         metavar="files | directories",
         help="Files or directories to count tokens over",
     )
     parser.add_argument(
-        "-m", "--model", default="unsloth/Qwen3-0.6B", help="huggingface model name"
+        "-m",
+        "--model",
+        default="unsloth/Qwen3-0.6B",
+        help="huggingface model name, or a local tokenizer.json (or directory holding one)",
+    )
+    parser.add_argument("-r", "--recursive", action="store_true", help="Recurse into directories")
+    parser.add_argument(
+        "-I",
+        "--include",
+        metavar="GLOB",
+        action="append",
+        default=[],
+        help="Only count files whose relative path or a path component matches GLOB",
+    )
+    parser.add_argument(
+        "-X",
+        "--exclude",
+        metavar="GLOB",
+        action="append",
+        default=[],
+        help="Skip files whose relative path or a path component matches GLOB",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        type=Path,
+        default=default_cache_path(),
+        help="Token count cache database path",
+    )
+    parser.add_argument(
+        "-C", "--no-cache", action="store_true", help="Don't read or write the token count cache"
+    )
+    parser.add_argument(
+        "-s",
+        "--stream",
+        action="store_true",
+        help="Tokenize files in chunks cut at newline/whitespace boundaries (approximate)",
+    )
+    parser.add_argument(
+        "-e",
+        "--exact",
+        action="store_true",
+        help="Stream with overlapping chunks so counts match whole-file tokenization",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=lambda x: int(x, 0),
+        default=1024 * 1024,
+        metavar="CHARS",
+        help="Streaming chunk size in characters",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=lambda x: int(x, 0),
+        default=4096,
+        metavar="CHARS",
+        help="Exact streaming overlap, must exceed the longest pre-token",
+    )
+    parser.add_argument(
+        "-R",
+        "--report",
+        nargs="?",
+        const="table",
+        choices=("table", "json"),
+        help="Report per-file and per-directory counts instead of just the total",
+    )
+    parser.add_argument(
+        "-n",
+        "--top",
+        type=int,
+        default=20,
+        metavar="N",
+        help="Number of largest files/directories to show in the report",
+    )
+    daemon_opts = parser.add_mutually_exclusive_group()
+    daemon_opts.add_argument(
+        "--serve", action="store_true", help="Keep the tokenizer resident and serve --client runs"
+    )
+    daemon_opts.add_argument(
+        "--client", action="store_true", help="Count tokens through a running --serve daemon"
+    )
+    parser.add_argument(
+        "--socket", type=Path, default=default_socket_path(), help="Daemon unix socket path"
     )
     return parser
 
 
 def main() -> None:
-    real_main(get_arg_parser().parse_args())
+    parser = get_arg_parser()
+    args = parser.parse_args()
+    if not args.paths and not args.serve:
+        parser.error("at least one file or directory is required")
+    real_main(args)
 
 
 if __name__ == "__main__":
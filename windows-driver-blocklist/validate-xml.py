@@ -1,10 +1,195 @@
 #!/usr/bin/env python3
+# Install dependencies using: pip install attrs path xmlschema (optionally lxml)
 
-import xmlschema
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-# Load and validate the XML files against the XSD schema
-xsd_schema = xmlschema.XMLSchema("CIPolicy.xsd")
+import attr
+from path import Path
 
-# Validate XML file
-is_valid = xsd_schema.is_valid("VulnerableDriverBlockList/SiPolicy_Enforced.xml")
-print(f"Is the XML file valid? {is_valid}")
+DEFAULT_SCHEMA = Path(__file__).parent / "CIPolicy.xsd"
+DEFAULT_POLICY = "VulnerableDriverBlockList/SiPolicy_Enforced.xml"
+
+# per-process validator, set up once by init_validator()
+_validator = None
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class ValidationError:
+    line: int | None = None
+    path: str | None = None
+    message: str
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class ValidationResult:
+    file: str
+    valid: bool
+    errors: list[ValidationError] = attr.ib(factory=list)
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path("~/.cache").expanduser()
+    return Path(cache_home) / "validate-xml"
+
+
+def have_lxml():
+    return importlib.util.find_spec("lxml") is not None
+
+
+def compiled_schema_path(schema_path, cache_dir):
+    import xmlschema
+
+    h = hashlib.sha256(xmlschema.__version__.encode())
+    h.update(b"\0" + Path(schema_path).read_bytes())
+    return cache_dir / f"{h.hexdigest()}.pickle"
+
+
+def load_xmlschema(schema_path, cache_dir=None):
+    """Compile schema_path with xmlschema, reusing a pickled compiled schema when cached."""
+    import xmlschema
+
+    if cache_dir is None:
+        return xmlschema.XMLSchema(schema_path)
+    cache_path = compiled_schema_path(schema_path, cache_dir)
+    if cache_path.is_file():
+        try:
+            return pickle.loads(cache_path.read_bytes())
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            # corrupt or from an incompatible environment, recompile
+            print(f"ignoring cached schema {cache_path}: {e}", file=sys.stderr)
+    schema = xmlschema.XMLSchema(schema_path)
+    cache_dir.makedirs_p()
+    with tempfile.NamedTemporaryFile(dir=cache_dir, delete=False) as f:
+        pickle.dump(schema, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, cache_path)
+    return schema
+
+
+def make_xmlschema_validator(schema):
+    import xmlschema
+
+    def validate(xml_file):
+        try:
+            errors = [
+                ValidationError(line=e.sourceline, path=e.path, message=e.reason or e.message)
+                for e in schema.iter_errors(xml_file)
+            ]
+        except (OSError, xmlschema.XMLSchemaException) as e:
+            errors = [ValidationError(message=f"{type(e).__name__}: {e}")]
+        return ValidationResult(file=xml_file, valid=not errors, errors=errors)
+
+    return validate
+
+
+def make_lxml_validator(schema_path):
+    from lxml import etree
+
+    schema = etree.XMLSchema(etree.parse(schema_path))
+
+    def validate(xml_file):
+        try:
+            doc = etree.parse(xml_file)
+        except etree.XMLSyntaxError as e:
+            err = ValidationError(line=e.lineno, message=str(e))
+            return ValidationResult(file=xml_file, valid=False, errors=[err])
+        except OSError as e:
+            err = ValidationError(message=f"{type(e).__name__}: {e}")
+            return ValidationResult(file=xml_file, valid=False, errors=[err])
+        valid = schema.validate(doc)
+        errors = [
+            ValidationError(line=e.line, path=e.path, message=e.message) for e in schema.error_log
+        ]
+        return ValidationResult(file=xml_file, valid=valid, errors=errors)
+
+    return validate
+
+
+def init_validator(engine, schema_path, cache_dir):
+    global _validator
+    if engine == "lxml":
+        _validator = make_lxml_validator(schema_path)
+    else:
+        _validator = make_xmlschema_validator(load_xmlschema(schema_path, cache_dir))
+
+
+def validate_file(xml_file):
+    return _validator(xml_file)
+
+
+def validate_files(files, engine, schema_path, cache_dir, jobs=None):
+    # compile (and cache) in the parent first so workers only ever unpickle
+    init_validator(engine, schema_path, cache_dir)
+    if len(files) == 1 or jobs == 1:
+        yield from map(validate_file, files)
+        return
+    with ProcessPoolExecutor(
+        max_workers=jobs, initializer=init_validator, initargs=(engine, schema_path, cache_dir)
+    ) as pool:
+        yield from pool.map(validate_file, files)
+
+
+def print_result(result, fmt):
+    if fmt == "json":
+        print(json.dumps(attr.asdict(result)))
+        return
+    print(f"{result.file}: {'valid' if result.valid else 'INVALID'}")
+    for e in result.errors:
+        loc = f"{result.file}:{e.line}" if e.line is not None else result.file
+        print(f"  {loc}: {e.path + ': ' if e.path else ''}{e.message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate SiPolicy XML files against CIPolicy.xsd")
+    parser.add_argument(
+        "files",
+        nargs="*",
+        default=[DEFAULT_POLICY],
+        help=f"Policy files (default: {DEFAULT_POLICY})",
+    )
+    parser.add_argument("-s", "--schema", default=DEFAULT_SCHEMA, help="XSD schema")
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=("auto", "xmlschema", "lxml"),
+        default="auto",
+        help="Validator, auto uses lxml when installed",
+    )
+    parser.add_argument("-f", "--format", choices=("text", "json"), default="text")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of validator processes")
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=default_cache_dir(),
+        help="Cache of compiled xmlschema schemas",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Always recompile the xmlschema schema"
+    )
+    args = parser.parse_args()
+
+    engine = args.engine
+    if engine == "auto":
+        engine = "lxml" if have_lxml() else "xmlschema"
+    cache_dir = None if args.no_cache else args.cache_dir
+    nvalid = ninvalid = 0
+    for result in validate_files(args.files, engine, str(args.schema), cache_dir, args.jobs):
+        print_result(result, args.format)
+        if result.valid:
+            nvalid += 1
+        else:
+            ninvalid += 1
+    if args.format == "text" and len(args.files) > 1:
+        print(f"{nvalid} valid, {ninvalid} invalid")
+    return 1 if ninvalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
-# Install dependencies using: pip install attrs requests pyyaml rich
+# Install dependencies using: pip install attrs path requests pyyaml rich
 
 import argparse
+import hashlib
 import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from xml.etree import ElementTree as ET
 
 import attr
 import requests
 import yaml
+from path import Path
 from rich.console import Console
 from rich.table import Table
 
@@ -35,36 +44,349 @@ class VulnerableDriverYAML:
 class MicrosoftBlocklistEntry:
     VersionEx: str | None = None
     PlatformID: str | None = None
+    Kind: str | None = None
     RuleOption: str | None = None
     FileRuleID: str | None = None
     FriendlyName: str | None = None
+    Hash: str | None = None
+    FileName: str | None = None
+    MinimumFileVersion: str | None = None
+    MaximumFileVersion: str | None = None
+    CertRoot: str | None = None
+    CertPublisher: str | None = None
+    FileAttribRefs: list | None = None
+
+
+MS_ENTRY_FIELDS = tuple(attr.fields_dict(MicrosoftBlocklistEntry))
+
+
+@attr.s(auto_attribs=True)
+class SiPolicyRules:
+    """Column-oriented SiPolicy rules, one list per MicrosoftBlocklistEntry field."""
+
+    columns: dict = attr.ib(factory=lambda: {name: [] for name in MS_ENTRY_FIELDS})
+
+    def __len__(self):
+        return len(self.columns["Kind"])
+
+    def append(self, **fields):
+        for name, column in self.columns.items():
+            column.append(fields.get(name))
+
+    def extend(self, other):
+        for name, column in self.columns.items():
+            column.extend(other.columns[name])
+
+    def fill(self, name, value, start=0):
+        column = self.columns[name]
+        column[start:] = [value] * (len(column) - start)
+
+    def rows(self):
+        for values in zip(*self.columns.values(), strict=True):
+            yield MicrosoftBlocklistEntry(**dict(zip(self.columns, values, strict=True)))
+
+    def count(self, kind):
+        return self.columns["Kind"].count(kind)
+
+    def hashes(self):
+        return {normalize_hash(h) for h in self.columns["Hash"] if h}
+
+    def file_names(self):
+        return {normalize_name(n) for n in self.columns["FileName"] if n and n != "*"}
+
+
+SAMPLE_HASH_KEYS = ("MD5", "SHA1", "SHA256")
+LOL_SOURCE = "loldrivers"
+MS_SOURCE = "ms-blocklist"
+
+
+# libyaml is several times faster than the pure Python loader when pyyaml was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# bump whenever the parse_* output changes to invalidate cached parses
+PARSER_VERSION = 2
+# below this many changed zip members a process pool costs more than it saves
+MIN_POOL_MEMBERS = 32
+
+
+def default_cache_dir() -> Path:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path("~/.cache").expanduser()
+    return Path(cache_home) / "windows-driver-blocklist"
+
+
+def default_index_path() -> Path:
+    return default_cache_dir() / "index.sqlite3"
+
+
+def _atomic_write(pth: Path, data: bytes) -> None:
+    with tempfile.NamedTemporaryFile(dir=pth.parent, delete=False) as f:
+        f.write(data)
+    os.replace(f.name, pth)
+
+
+def _dump_json(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+class SnapshotCache:
+    """On-disk cache of the source zips and everything parsed out of them.
+
+    Downloaded zips live in blobs/<sha256> with sources/<sha256(url)>.json entries keeping the
+    HTTP validators for conditional re-fetching. parsed-members.json maps the sha256 of each
+    YAML/XML zip member to its parsed documents so only changed members get reparsed, and
+    dataset.json holds the assembled dataset for the last pair of source snapshots.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.blob_dir = root / "blobs"
+        self.source_dir = root / "sources"
+        self.parsed_path = root / "parsed-members.json"
+        self.dataset_path = root / "dataset.json"
+        self.blob_dir.makedirs_p()
+        self.source_dir.makedirs_p()
+
+    def _source_entry_path(self, url: str) -> Path:
+        return self.source_dir / (hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def fetch(self, source: str, offline: bool = False) -> tuple[bytes, str]:
+        """Contents and sha256 of a source zip, re-downloading URLs only if they changed."""
+        if not source.startswith("http"):
+            data = Path(source).read_bytes()
+            return data, hashlib.sha256(data).hexdigest()
+        entry_path = self._source_entry_path(source)
+        entry = json.loads(entry_path.read_bytes()) if entry_path.is_file() else {}
+        blob_path = self.blob_dir / entry["digest"] if entry else None
+        if blob_path is None or not blob_path.is_file():
+            entry = {}
+        elif offline:
+            return blob_path.read_bytes(), entry["digest"]
+        headers = {}
+        if "etag" in entry:
+            headers["If-None-Match"] = entry["etag"]
+        if "last_modified" in entry:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        response = requests.get(source, headers=headers, timeout=60)
+        response.raise_for_status()
+        if response.status_code == 304 and blob_path is not None:
+            return blob_path.read_bytes(), entry["digest"]
+        data = response.content
+        digest = hashlib.sha256(data).hexdigest()
+        if not (self.blob_dir / digest).is_file():
+            _atomic_write(self.blob_dir / digest, data)
+        entry = {"url": source, "digest": digest}
+        if etag := response.headers.get("ETag"):
+            entry["etag"] = etag
+        if last_modified := response.headers.get("Last-Modified"):
+            entry["last_modified"] = last_modified
+        _atomic_write(entry_path, _dump_json(entry))
+        return data, digest
+
+    def load_parsed_members(self) -> dict:
+        if not self.parsed_path.is_file():
+            return {}
+        cached = json.loads(self.parsed_path.read_bytes())
+        return cached["members"] if cached.get("parser") == PARSER_VERSION else {}
+
+    def save_parsed_members(self, members: dict) -> None:
+        _atomic_write(self.parsed_path, _dump_json({"parser": PARSER_VERSION, "members": members}))
+
+    def load_dataset(self, digests: dict):
+        if not self.dataset_path.is_file():
+            return None
+        dataset = json.loads(self.dataset_path.read_bytes())
+        if dataset["digests"] != digests:
+            return None
+        return dataset["lol_drivers"], dataset["ms_blocklist"]
+
+    def save_dataset(self, digests: dict, lol_docs: list, ms_docs: list) -> None:
+        dataset = {"digests": digests, "lol_drivers": lol_docs, "ms_blocklist": ms_docs}
+        _atomic_write(self.dataset_path, _dump_json(dataset))
 
 
 def normalize_hash(hash_string):
-    return hash_string.replace("-", "").lower()
+    return hash_string.strip().replace("-", "").lower()
+
+
+def normalize_name(name):
+    return name.strip().lower()
+
+
+def sample_hashes(sample):
+    """(kind, normalized hash) pairs of a KnownVulnerableSamples entry, Authentihash included."""
+    hashes = [(h.lower(), normalize_hash(v)) for h in SAMPLE_HASH_KEYS if (v := sample.get(h))]
+    authentihash = sample.get("Authentihash")
+    if isinstance(authentihash, dict):
+        hashes += [
+            (f"authentihash-{h.lower()}", normalize_hash(v))
+            for h in SAMPLE_HASH_KEYS
+            if (v := authentihash.get(h))
+        ]
+    return [(kind, h) for kind, h in hashes if h]
+
+
+def sample_names(sample):
+    names = {sample.get("Filename"), sample.get("OriginalFilename")}
+    return [normalize_name(n) for n in names if isinstance(n, str) and n.strip()]
+
+
+def lol_driver_keys(driver):
+    """(kind, key, sample index) triples indexed for a LOLDrivers entry."""
+    keys = [("name", normalize_name(t), None) for t in driver.Tags or [] if isinstance(t, str)]
+    for i, sample in enumerate(driver.KnownVulnerableSamples or []):
+        if not isinstance(sample, dict):
+            continue
+        keys += [(kind, h, i) for kind, h in sample_hashes(sample)]
+        keys += [("name", n, i) for n in sample_names(sample)]
+    return keys
+
+
+def ms_entry_keys(entry):
+    """(kind, key) pairs indexed for a Microsoft blocklist entry."""
+    keys = []
+    if entry.FriendlyName:
+        keys.append(("name", normalize_name(entry.FriendlyName)))
+    if entry.FileRuleID:
+        keys.append(("rule-id", normalize_name(entry.FileRuleID)))
+    if entry.Hash:
+        keys.append(("sipolicy-hash", normalize_hash(entry.Hash)))
+    if entry.FileName and entry.FileName != "*":
+        keys.append(("name", normalize_name(entry.FileName)))
+    if entry.CertRoot:
+        keys.append(("cert-root", normalize_hash(entry.CertRoot)))
+    return keys
+
+
+class BlocklistIndex:
+    """Prebuilt key -> entry index over both sources, stored as a sqlite database.
+
+    Entries are stored once as JSON, the keys table maps every normalized hash and driver name
+    to the entries (and LOLDrivers sample) carrying it so lookups never touch the sources.
+    """
+
+    def __init__(self, db_path: Path) -> None:
+        if db_path.parent:
+            db_path.parent.makedirs_p()
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, source TEXT NOT NULL, doc TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS keys ("
+            "key TEXT NOT NULL, kind TEXT NOT NULL, entry_id INTEGER NOT NULL, sample INTEGER);"
+            "CREATE INDEX IF NOT EXISTS keys_key ON keys (key);"
+        )
 
+    def get_meta(self, name):
+        row = self.db.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_meta(self, name, value):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (name, value))
+
+    def is_empty(self):
+        return self.db.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None
+
+    def rebuild(self, lol_drivers, ms_blocklist, meta):
+        with self.db:
+            self.db.execute("DELETE FROM keys")
+            self.db.execute("DELETE FROM entries")
+            self.db.execute("DELETE FROM meta")
+            self.db.executemany("INSERT INTO meta VALUES (?, ?)", meta.items())
+            for source, entries, get_keys in (
+                (LOL_SOURCE, lol_drivers, lol_driver_keys),
+                (
+                    MS_SOURCE,
+                    ms_blocklist.rows(),
+                    lambda e: [(k, v, None) for k, v in ms_entry_keys(e)],
+                ),
+            ):
+                for entry in entries:
+                    cur = self.db.execute(
+                        "INSERT INTO entries (source, doc) VALUES (?, ?)",
+                        (source, json.dumps(attr.asdict(entry), separators=(",", ":"))),
+                    )
+                    self.db.executemany(
+                        "INSERT INTO keys VALUES (?, ?, ?, ?)",
+                        {(key, kind, cur.lastrowid, i) for kind, key, i in get_keys(entry)},
+                    )
 
-def download_and_extract_zip(url):
-    response = requests.get(url)
-    with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-        extracted_files = {name: z.read(name) for name in z.namelist() if not name.endswith("/")}
-    return extracted_files
+    def lookup(self, query):
+        """Matches for a hash or driver name as (source, kind, entry dict, sample index) tuples."""
+        candidates = {normalize_hash(query), normalize_name(query)}
+        rows = self.db.execute(
+            "SELECT DISTINCT e.source, k.kind, e.doc, k.sample FROM keys k "
+            "JOIN entries e ON e.id = k.entry_id "
+            f"WHERE k.key IN ({', '.join('?' * len(candidates))}) ORDER BY e.id, k.sample",
+            tuple(candidates),
+        )
+        return [(source, kind, json.loads(doc), sample) for source, kind, doc, sample in rows]
 
+    def lookup_many(self, queries):
+        return {q: self.lookup(q) for q in queries}
 
-def extract_zip_to_memory(zip_path):
-    extracted_files = {}
-    with zipfile.ZipFile(zip_path, "r") as z:
-        for file_info in z.infolist():
-            if file_info.is_dir():
-                continue
-            with z.open(file_info) as file:
-                extracted_files[file_info.filename] = file.read()
-    return extracted_files
+    def close(self):
+        self.db.close()
+
+
+def read_queries(query_file):
+    """One hash or driver name per line, '#' comments and blank lines skipped."""
+    if query_file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        lines = Path(query_file).read_text().splitlines()
+    queries = [line.split("#", 1)[0].strip() for line in lines]
+    return list(dict.fromkeys(q for q in queries if q))
+
+
+def print_matches(query, matches):
+    console.print(f"Searching for: {query}")
+    for source, kind, doc, sample in matches:
+        if source == LOL_SOURCE:
+            where = "LOLDrivers YAML" if sample is None else f"LOLDrivers YAML sample {sample}"
+        else:
+            where = "Microsoft Blocklist XML"
+        console.print(f"Match ({kind}) found in {where}: {doc}")
+    if not matches:
+        console.print("No match found")
+
+
+def print_batch_matches(results):
+    table = Table(title="Hash Lookup", show_header=True, header_style="bold magenta")
+    table.add_column("Query", style="cyan")
+    table.add_column("Source", style="yellow")
+    table.add_column("Kind")
+    table.add_column("Entry", style="green")
+    nfound = 0
+    for query, matches in results.items():
+        if matches:
+            nfound += 1
+        else:
+            table.add_row(query, "-", "-", "[red]no match[/red]")
+        # one row per matched entry, even when several of its keys (or samples) matched
+        kinds_by_entry = {}
+        for source, kind, doc, _ in matches:
+            label = doc.get("Id") if source == LOL_SOURCE else doc.get("FriendlyName")
+            entry = (source, label or doc.get("FileRuleID") or "N/A")
+            kinds_by_entry.setdefault(entry, {})[kind] = None
+        for (source, label), kinds in kinds_by_entry.items():
+            table.add_row(query, source, ", ".join(kinds), label)
+    console.print(table)
+    console.print(f"{nfound}/{len(results)} queries matched")
+
+
+def fetch_source(source):
+    if source.startswith("http"):
+        response = requests.get(source, timeout=60)
+        response.raise_for_status()
+        data = response.content
+    else:
+        data = Path(source).read_bytes()
+    return data, hashlib.sha256(data).hexdigest()
 
 
 def parse_lol_drivers_yaml(file_content):
     yaml_entries = []
-    for doc in yaml.safe_load_all(file_content):
+    for doc in yaml.load_all(file_content, Loader=YamlLoader):
         if isinstance(doc, dict):
             filtered_doc = {
                 k: v for k, v in doc.items() if k in attr.fields_dict(VulnerableDriverYAML)
@@ -73,52 +395,79 @@ def parse_lol_drivers_yaml(file_content):
     return yaml_entries
 
 
-def parse_ms_blocklist_xml(file_content):
-    blocklist_entries = []
-    ns = {"ns0": "urn:schemas-microsoft-com:sipolicy"}
-
-    tree = ET.ElementTree(ET.fromstring(file_content))
-    root = tree.getroot()
-
-    version_ex = root.findtext("ns0:VersionEx", namespaces=ns)
-    platform_id = root.findtext("ns0:PlatformID", namespaces=ns)
-
-    for rule in root.findall("ns0:Rules/ns0:Rule", namespaces=ns):
-        rule_option = rule.findtext("ns0:Option", namespaces=ns)
-        blocklist_entries.append(
-            MicrosoftBlocklistEntry(
-                VersionEx=version_ex, PlatformID=platform_id, RuleOption=rule_option
-            )
-        )
-
-    for file_rule in root.findall("ns0:FileRules/ns0:Allow", namespaces=ns):
-        file_rule_id = file_rule.get("ID")
-        friendly_name = file_rule.get("FriendlyName")
-        blocklist_entries.append(
-            MicrosoftBlocklistEntry(
-                VersionEx=version_ex,
-                PlatformID=platform_id,
-                FileRuleID=file_rule_id,
-                FriendlyName=friendly_name,
+def _local_name(tag):
+    return tag.rpartition("}")[2]
+
+
+def parse_ms_blocklist_xml(file_content, rules=None):
+    """Stream the rules of a SiPolicy document into a SiPolicyRules.
+
+    Every element is dropped from its parent once its end tag has been handled so memory use
+    does not grow with the document. Allow/Deny/FileAttrib file rules, policy rule options and
+    signers (with their TBS cert root and referenced file attributes) each become a row.
+    """
+    if rules is None:
+        rules = SiPolicyRules()
+    first_row = len(rules)
+    version_ex = platform_id = signer = None
+    stack = []
+    for event, elem in ET.iterparse(io.BytesIO(file_content), events=("start", "end")):
+        tag = _local_name(elem.tag)
+        if event == "start":
+            if tag == "Signer":
+                signer = {
+                    "Kind": tag,
+                    "FileRuleID": elem.get("ID"),
+                    "FriendlyName": elem.get("Name"),
+                }
+                signer["FileAttribRefs"] = []
+            stack.append(elem)
+            continue
+        stack.pop()
+        if not stack:
+            break
+        parent = stack[-1]
+        parent_tag = _local_name(parent.tag)
+        if parent_tag == "SiPolicy" and tag == "VersionEx":
+            version_ex = elem.text
+        elif parent_tag == "SiPolicy" and tag == "PlatformID":
+            platform_id = elem.text
+        elif parent_tag == "Rule" and tag == "Option":
+            rules.append(Kind="Rule", RuleOption=elem.text)
+        elif parent_tag == "FileRules":
+            rules.append(
+                Kind=tag,
+                FileRuleID=elem.get("ID"),
+                FriendlyName=elem.get("FriendlyName"),
+                Hash=elem.get("Hash"),
+                FileName=elem.get("FileName"),
+                MinimumFileVersion=elem.get("MinimumFileVersion"),
+                MaximumFileVersion=elem.get("MaximumFileVersion"),
             )
-        )
-
-    return blocklist_entries
+        elif parent_tag == "Signer" and signer is not None:
+            if tag == "CertRoot":
+                signer["CertRoot"] = elem.get("Value")
+            elif tag == "CertPublisher":
+                signer["CertPublisher"] = elem.get("Value")
+            elif tag == "FileAttribRef":
+                signer["FileAttribRefs"].append(elem.get("RuleID"))
+        elif tag == "Signer" and signer is not None:
+            rules.append(**signer)
+            signer = None
+        elem.clear()
+        parent.remove(elem)
+    rules.fill("VersionEx", version_ex, first_row)
+    rules.fill("PlatformID", platform_id, first_row)
+    return rules
 
 
 def find_discrepancies_with_summary(lol_drivers, ms_blocklist, verbose=False):
-    ms_hashes = set()
+    # the Deny hash rules carry Authenticode hashes, FileAttrib rules block by original file name
+    ms_hashes = ms_blocklist.hashes()
+    ms_names = ms_blocklist.file_names()
     discrepancies = []
     critical_discrepancies = []
 
-    for entry in ms_blocklist:
-        if entry.FileRuleID:
-            ms_hashes.add(entry.FileRuleID.lower())
-        if entry.FriendlyName:
-            ms_hashes.add(entry.FriendlyName.lower())
-        if entry.RuleOption:
-            ms_hashes.add(entry.RuleOption.lower())
-
     table = Table(title="Discrepancy Report", show_header=True, header_style="bold magenta")
     table.add_column("ID", style="cyan", no_wrap=True)
     table.add_column("Category", style="yellow")
@@ -127,10 +476,12 @@ def find_discrepancies_with_summary(lol_drivers, ms_blocklist, verbose=False):
     for driver in lol_drivers:
         is_critical = False
         for sample in driver.KnownVulnerableSamples:
-            driver_hashes = {
-                normalize_hash(sample.get(h)) for h in ["SHA1", "SHA256"] if sample.get(h)
-            }
-            if not driver_hashes.intersection(ms_hashes):
+            if not isinstance(sample, dict):
+                continue
+            driver_hashes = {h for _, h in sample_hashes(sample)}
+            if not driver_hashes.intersection(ms_hashes) and ms_names.isdisjoint(
+                sample_names(sample)
+            ):
                 if verbose:
                     table.add_row(
                         driver.Id or "N/A", driver.Category or "N/A", driver.Description or "N/A"
@@ -145,6 +496,11 @@ def find_discrepancies_with_summary(lol_drivers, ms_blocklist, verbose=False):
             critical_discrepancies.append(driver)
 
     console.print("[bold]Summary:[/bold]")
+    console.print(
+        f"Microsoft blocklist: {len(ms_hashes)} distinct hashes, "
+        f"{ms_blocklist.count('FileAttrib')} file attribute rules, "
+        f"{ms_blocklist.count('Signer')} signers"
+    )
     console.print(f"Total discrepancies found: {len(discrepancies)}")
     console.print(
         f"Total critical discrepancies (vulnerable drivers): {len(critical_discrepancies)}"
@@ -162,6 +518,98 @@ def find_discrepancies_with_summary(lol_drivers, ms_blocklist, verbose=False):
         return discrepancies
 
 
+def parse_member(kind, content):
+    """Parse one zip member into plain dicts, run in worker processes."""
+    if kind == "yaml":
+        return [attr.asdict(e) for e in parse_lol_drivers_yaml(content)]
+    return parse_ms_blocklist_xml(content).columns
+
+
+def parse_zip_members(data, kind, parsed, jobs=None):
+    """Parse results of all members of a zip with the kind ("yaml"/"xml") suffix, in order.
+
+    parsed maps "<kind>:<sha256 of member>" to already parsed results and is updated with the
+    newly parsed members. Returns the per-member results and their parsed keys.
+    """
+    members = []
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        for info in z.infolist():
+            if info.is_dir() or not info.filename.endswith(f".{kind}"):
+                continue
+            content = z.read(info)
+            members.append((f"{kind}:{hashlib.sha256(content).hexdigest()}", kind, content))
+    todo = {key: (kind, content) for key, kind, content in members if key not in parsed}
+    if len(todo) >= MIN_POOL_MEMBERS:
+        kinds, contents = zip(*todo.values(), strict=True)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed.update(zip(todo, pool.map(parse_member, kinds, contents, chunksize=16)))
+    else:
+        parsed.update((key, parse_member(kind, content)) for key, (kind, content) in todo.items())
+    keys = [key for key, _, _ in members]
+    return [parsed[key] for key in keys], keys
+
+
+def fetch_snapshots(args, cache):
+    """Both source zips and the digests identifying this pair of snapshots."""
+    if cache is None:
+        lol_data, lol_digest = fetch_source(args.lol_drivers)
+        ms_data, ms_digest = fetch_source(args.ms_blocklist)
+    else:
+        lol_data, lol_digest = cache.fetch(args.lol_drivers, offline=args.offline)
+        ms_data, ms_digest = cache.fetch(args.ms_blocklist, offline=args.offline)
+    digests = {"lol_drivers": lol_digest, "ms_blocklist": ms_digest, "parser": PARSER_VERSION}
+    return lol_data, ms_data, digests
+
+
+def load_dataset(lol_data, ms_data, digests, cache, jobs=None):
+    dataset = cache.load_dataset(digests) if cache is not None else None
+    if dataset is None:
+        parsed = cache.load_parsed_members() if cache is not None else {}
+        lol_results, lol_keys = parse_zip_members(lol_data, "yaml", parsed, jobs)
+        ms_results, ms_keys = parse_zip_members(ms_data, "xml", parsed, jobs)
+        lol_docs = [doc for docs in lol_results for doc in docs]
+        ms_rules = SiPolicyRules()
+        for columns in ms_results:
+            ms_rules.extend(SiPolicyRules(columns))
+        ms_docs = ms_rules.columns
+        if cache is not None:
+            # only keep the members of the current snapshots around
+            cache.save_parsed_members({k: parsed[k] for k in lol_keys + ms_keys})
+            cache.save_dataset(digests, lol_docs, ms_docs)
+        dataset = lol_docs, ms_docs
+    lol_docs, ms_docs = dataset
+    return [VulnerableDriverYAML(**d) for d in lol_docs], SiPolicyRules(ms_docs)
+
+
+def open_index(args, cache):
+    """Open the lookup index, (re)building it when missing or built from other snapshots.
+
+    Lookups are answered from the index alone. The sources are only fetched again (and the index
+    rebuilt if they changed) on --rebuild-index, or once the last check is --index-max-age old.
+    """
+    index = BlocklistIndex(args.index)
+    sources = json.dumps([args.lol_drivers, args.ms_blocklist])
+    checked_at = float(index.get_meta("checked_at") or 0)
+    fresh = (
+        not index.is_empty()
+        and index.get_meta("sources") == sources
+        and time.time() - checked_at < args.index_max_age * 3600
+    )
+    if fresh and not args.rebuild_index:
+        return index
+    lol_data, ms_data, digests = fetch_snapshots(args, cache)
+    meta = {k: str(v) for k, v in digests.items()}
+    meta["sources"] = sources
+    meta["checked_at"] = str(time.time())
+    stale = any(index.get_meta(k) != v for k, v in meta.items() if k != "checked_at")
+    if args.rebuild_index or stale or index.is_empty():
+        console.print(f"Building index {args.index}")
+        index.rebuild(*load_dataset(lol_data, ms_data, digests, cache, args.jobs), meta)
+    else:
+        index.set_meta("checked_at", meta["checked_at"])
+    return index
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Compare LOLDrivers YAML and Microsoft Blocklist XML."
@@ -177,56 +625,70 @@ def main():
         help="Path to Microsoft blocklist zip file or URL",
     )
     parser.add_argument(
-        "--hash", help="Hash to search for (will normalize and search across both lists)"
+        "--hash",
+        help="Hash or driver name to search for (will normalize and search across both lists)",
+    )
+    parser.add_argument(
+        "--hash-file",
+        help="File with one hash or driver name per line to search for ('-' for stdin)",
+    )
+    parser.add_argument(
+        "--index",
+        type=Path,
+        default=default_index_path(),
+        help="Prebuilt lookup index used by --hash/--hash-file",
+    )
+    parser.add_argument(
+        "--rebuild-index", action="store_true", help="Rebuild the lookup index from the sources"
     )
+    parser.add_argument(
+        "--index-max-age",
+        type=float,
+        default=24,
+        metavar="HOURS",
+        help="Check the sources for updates when the index was last checked this long ago",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=default_cache_dir(),
+        help="Cache of downloaded snapshots and parsed data",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Always download and reparse everything"
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="Use cached snapshots without checking for updates"
+    )
+    parser.add_argument("-j", "--jobs", type=int, help="Number of parser processes")
     parser.add_argument("--verbose", action="store_true", help="Print verbose output")
     args = parser.parse_args()
 
-    if args.lol_drivers.startswith("http"):
-        lol_drivers_files = download_and_extract_zip(args.lol_drivers)
-    else:
-        lol_drivers_files = extract_zip_to_memory(args.lol_drivers)
-
-    if args.ms_blocklist.startswith("http"):
-        ms_blocklist_files = download_and_extract_zip(args.ms_blocklist)
-    else:
-        ms_blocklist_files = extract_zip_to_memory(args.ms_blocklist)
-
-    lol_drivers_entries = []
-    for file_name, content in lol_drivers_files.items():
-        if file_name.endswith(".yaml"):
-            lol_drivers_entries.extend(parse_lol_drivers_yaml(content))
-
-    ms_blocklist_entries = []
-    for file_name, content in ms_blocklist_files.items():
-        if file_name.endswith(".xml"):
-            ms_blocklist_entries.extend(parse_ms_blocklist_xml(content))
-
-    if args.hash:
-        normalized_hash = normalize_hash(args.hash)
-        console.print(f"Searching for hash: {normalized_hash}")
-        for driver in lol_drivers_entries:
-            for sample in driver.KnownVulnerableSamples:
-                driver_hashes = {
-                    normalize_hash(sample.get(h)) for h in ["SHA1", "SHA256"] if sample.get(h)
-                }
-                if normalized_hash in driver_hashes:
-                    console.print(f"Match found in LOLDrivers YAML: {attr.asdict(driver)}")
-
-        for block_entry in ms_blocklist_entries:
-            if normalized_hash in {
-                block_entry.FileRuleID,
-                block_entry.FriendlyName,
-                block_entry.RuleOption,
-            }:
-                console.print(f"Match found in Microsoft Blocklist XML: {attr.asdict(block_entry)}")
-    else:
-        discrepancies = find_discrepancies_with_summary(
-            lol_drivers_entries, ms_blocklist_entries, verbose=args.verbose
-        )
-        if not args.verbose:
-            for discrepancy in discrepancies:
-                console.print(f"Discrepancy found: {attr.asdict(discrepancy)}")
+    cache = None if args.no_cache else SnapshotCache(args.cache_dir)
+    queries = [args.hash] if args.hash else []
+    if args.hash_file:
+        queries += read_queries(args.hash_file)
+    if args.hash or args.hash_file:
+        index = open_index(args, cache)
+        try:
+            results = index.lookup_many(queries)
+        finally:
+            index.close()
+        if args.hash_file:
+            print_batch_matches(results)
+        else:
+            print_matches(args.hash, results[args.hash])
+        return
+
+    lol_drivers_entries, ms_blocklist_entries = load_dataset(
+        *fetch_snapshots(args, cache), cache, args.jobs
+    )
+    discrepancies = find_discrepancies_with_summary(
+        lol_drivers_entries, ms_blocklist_entries, verbose=args.verbose
+    )
+    if not args.verbose:
+        for discrepancy in discrepancies:
+            console.print(f"Discrepancy found: {attr.asdict(discrepancy)}")
 
 
 if __name__ == "__main__":